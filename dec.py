@@ -1,8 +1,25 @@
 import os
 import sys
+import asyncio
+import json
+import mmap
 import struct
 import re
-from io import BytesIO
+import signal
+import fnmatch
+import glob
+import hashlib
+import stat
+import time
+import shutil
+import tarfile
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from io import BufferedReader, BytesIO, RawIOBase
+from urllib.parse import parse_qs, unquote, urlsplit
 
 __VERSION__ = "1.0.0"
 
@@ -16,6 +33,71 @@ def advance_magic(magic):
     magic = (magic * 7 + 3) & 0xFFFFFFFF
     return old, magic
 
+def skip_magic(magic, words):
+    """advance_magic applied words times, in O(log words)"""
+    # 7**n * magic + 3 * (7**n - 1) / 6, the division done exactly mod 6 * 2**32
+    power = pow(7, words, 6 << 32)
+    return (pow(7, words, 1 << 32) * magic + 3 * ((power - 1) // 6)) & 0xFFFFFFFF
+
+# Key stream lanes: word j of the stream is (7**j * magic + c_j) mod 2**32.
+# The multipliers and offsets are packed into wide integers, one 9-byte
+# lane per word (room for the 65-bit product), so a whole buffer of keys
+# is one big-int multiply-add instead of a Python loop per word.
+_LANE = 9
+_lanes = (0, 0, 0)  # (words, multipliers, offsets)
+_last_lanes = (0, 0, 0)  # same, trimmed for the last size asked
+
+def _keystream_lanes(nwords):
+    global _lanes, _last_lanes
+    if _last_lanes[0] == nwords:
+        return _last_lanes[1:]
+    count, mul, add = _lanes
+    if nwords > count:
+        count = max(nwords, 2 * count, 2048)
+        mul_bytes = bytearray(_LANE * count)
+        add_bytes = bytearray(_LANE * count)
+        a, c = 1, 0
+        for j in range(0, _LANE * count, _LANE):
+            mul_bytes[j:j + 4] = a.to_bytes(4, 'little')
+            add_bytes[j:j + 4] = c.to_bytes(4, 'little')
+            a = (a * 7) & 0xFFFFFFFF
+            c = (c * 7 + 3) & 0xFFFFFFFF
+        mul = int.from_bytes(mul_bytes, 'little')
+        add = int.from_bytes(add_bytes, 'little')
+        _lanes = (count, mul, add)
+    if nwords != count:
+        mask = (1 << (8 * _LANE * nwords)) - 1
+        mul, add = mul & mask, add & mask
+    _last_lanes = (nwords, mul, add)
+    return mul, add
+
+def keystream(magic, nwords):
+    """Little-endian bytes of nwords successive keys, starting with magic"""
+    mul, add = _keystream_lanes(nwords)
+    lanes = (magic * mul + add).to_bytes(_LANE * nwords, 'little')
+    key = bytearray(4 * nwords)
+    for i in range(4):
+        key[i::4] = lanes[i::_LANE]
+    return key
+
+def xor_keystream(data, magic):
+    """XOR-code data from magic, return (coded bytes, magic for the next word)
+
+    Trailing bytes past the last whole u32 use the next key, as RGSS does.
+    """
+    size = len(data)
+    words = size // 4
+    key = keystream(magic, words + 1)
+    coded = int.from_bytes(data, 'little') ^ int.from_bytes(key[:size], 'little')
+    return coded.to_bytes(size, 'little'), int.from_bytes(key[4 * words:4 * words + 4], 'little')
+
+def xor_name_rgssad(name, magic):
+    """XOR a v1/v2 entry name, one key per byte, return (coded name, next magic)"""
+    size = len(name)
+    key = keystream(magic, size + 1)
+    coded = int.from_bytes(name, 'little') ^ int.from_bytes(key[0:4 * size:4], 'little')
+    return coded.to_bytes(size, 'little'), int.from_bytes(key[4 * size:], 'little')
+
 def ru32(stream):
     data = stream.read(4)
     if len(data) < 4:
@@ -45,42 +127,427 @@ class Coder:
         self.buf = bytearray(8192)
 
     def copy(self, stream_in, stream_out, data):
+        for chunk in self.chunks(stream_in, data):
+            stream_out.write(chunk)
+
+    def chunks(self, stream_in, data):
+        """Yield the XOR-coded payload described by data, one buffer at a time"""
         stream_in.seek(data.offset)
         magic = data.magic
         remaining = data.size
 
         while remaining > 0:
             chunk_size = min(len(self.buf), remaining)
-            chunk = bytearray(read_until_full(stream_in, chunk_size))
+            chunk = read_until_full(stream_in, chunk_size)
             if not chunk:
                 break
 
-            # Process aligned u32 chunks
-            aligned_size = (len(chunk) // 4) * 4
-            for i in range(0, aligned_size, 4):
-                old_magic, magic = advance_magic(magic)
-                val = struct.unpack('<I', chunk[i:i+4])[0]
-                val ^= old_magic
-                chunk[i:i+4] = struct.pack('<I', val)
+            chunk, magic = xor_keystream(chunk, magic)
+            yield chunk
+            remaining -= len(chunk)
+
+BLOCK_SIZE = 1 << 16
+DEFAULT_CACHE_BYTES = 16 << 20
 
-            # Process remaining bytes
-            for i in range(aligned_size, len(chunk)):
-                chunk[i] ^= (magic >> ((i % 4) * 8)) & 0xFF
+class BlockCache:
+    """LRU of decrypted payload blocks, keyed by (payload offset, block index).
 
-            stream_out.write(chunk)
-            remaining -= len(chunk)
+    Holds at most max_bytes of block data; hits and misses are counted.
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.blocks = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        block = self.blocks.get(key)
+        if block is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.blocks.move_to_end(key)
+        return block
+
+    def put(self, key, block):
+        if len(block) > self.max_bytes:
+            return
+        old = self.blocks.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.blocks[key] = block
+        self.size += len(block)
+        while self.size > self.max_bytes:
+            self.size -= len(self.blocks.popitem(last=False)[1])
+
+    def clear(self):
+        self.blocks.clear()
+        self.size = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "blocks": len(self.blocks),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+        }
+
+def read_payload(stream, data, pos, size, cache=None):
+    """Decrypted bytes [pos, pos + size) of a payload, by BLOCK_SIZE blocks if cached"""
+    size = min(size, data.size - pos)
+    if size <= 0:
+        return b''
+
+    if cache is None:
+        # Decrypt from the enclosing u32 boundary, the key depends on the word index
+        start = pos - pos % 4
+        stream.seek(data.offset + start)
+        raw = read_until_full(stream, pos + size - start)
+        return xor_keystream(raw, skip_magic(data.magic, start // 4))[0][pos - start:]
+
+    first = pos // BLOCK_SIZE
+    blocks = []
+    for index in range(first, (pos + size - 1) // BLOCK_SIZE + 1):
+        key = (data.offset, index)
+        block = cache.get(key)
+        if block is None:
+            begin = index * BLOCK_SIZE
+            stream.seek(data.offset + begin)
+            raw = read_until_full(stream, min(BLOCK_SIZE, data.size - begin))
+            block = xor_keystream(raw, skip_magic(data.magic, begin // 4))[0]
+            cache.put(key, block)
+        blocks.append(block)
+
+    start = pos - first * BLOCK_SIZE
+    if len(blocks) == 1:
+        return blocks[0][start:start + size]
+    return b''.join(blocks)[start:start + size]
+
+class EntryReader(RawIOBase):
+    """Seekable read-only file object over the decrypted payload of an entry"""
+    def __init__(self, stream, data, cache=None):
+        self.stream = stream
+        self.data = data
+        self.cache = cache
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += self.data.size
+        self.pos = max(pos, 0)
+        return self.pos
+
+    def readinto(self, b):
+        chunk = read_payload(self.stream, self.data, self.pos, len(b), self.cache)
+        b[:len(chunk)] = chunk
+        self.pos += len(chunk)
+        return len(chunk)
+
+class ChunkReader(RawIOBase):
+    """Forward-only file object over an iterable of byte chunks.
+
+    With size given, closing it checks that exactly size bytes were there,
+    so a generated entry cannot silently disagree with its index size.
+    """
+    def __init__(self, chunks, name='', size=None):
+        self.chunks = iter(chunks)
+        self.name = name
+        self.size = size
+        self.pending = memoryview(b'')
+        self.offset = 0  # into pending, so reads never copy the rest of a chunk
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=0):
+        # Coder seeks to the start of the payload, which is where we are
+        if (whence == 0 and pos == self.pos) or (whence == 1 and pos == 0):
+            return self.pos
+        raise OSError(f"{self.name}: cannot seek in a streamed entry")
+
+    def readinto(self, b):
+        while self.offset == len(self.pending):
+            # Released first: the producer may resize a bytearray it reuses
+            self.pending.release()
+            self.pending, self.offset = memoryview(b''), 0
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.pending = memoryview(chunk).cast('B')
+        n = min(len(b), len(self.pending) - self.offset)
+        b[:n] = self.pending[self.offset:self.offset + n]
+        self.offset += n
+        self.pos += n
+        return n
+
+    def close(self):
+        if not self.closed and self.size is not None:
+            if self.pos < self.size or self.offset < len(self.pending) or next(self.chunks, b''):
+                self.pending.release()
+                super().close()
+                raise ValueError(f"{self.name}: source does not hold the declared {self.size} bytes")
+        self.pending.release()
+        super().close()
+
+class CountingWriter:
+    """Write-only stream wrapper that counts bytes, so archives can be written
+    to pipes and sockets (offsets are taken from tell())."""
+    def __init__(self, stream):
+        self.stream = stream
+        self.pos = 0
+
+    @property
+    def closed(self):
+        return self.stream.closed
+
+    def write(self, data):
+        self.stream.write(data)
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+class ConsoleSink:
+    """One "Extracting: name" style line per entry (the default output)"""
+    labels = {'unpack': 'Extracting', 'pack': 'Packing', 'export': 'Exporting'}
+
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def event(self, progress, kind):
+        pass
+
+    def entry(self, progress, name, size, action):
+        label = self.labels.get(progress.stage)
+        if label and action != 'skip':
+            print(f"{label}: {name}", file=self.stream or sys.stdout)
+
+class JSONLSink:
+    """One JSON object per line: begin/end of each stage and every entry.
+
+    With owned=True, close() also closes out (a file opened for the sink).
+    """
+    def __init__(self, out, owned=False):
+        self.out = out
+        self.owned = owned
+
+    def write(self, record):
+        self.out.write(json.dumps(record) + '\n')
+
+    def event(self, progress, kind):
+        self.write(dict(event=kind, **progress.snapshot()))
+        self.out.flush()
+
+    def entry(self, progress, name, size, action):
+        self.write(dict(event=action, name=name, size=size, **progress.snapshot()))
+
+    def close(self):
+        if self.out.closed:
+            return
+        self.out.flush()
+        if self.owned:
+            self.out.close()
+
+class PrometheusSink:
+    """node_exporter textfile, rewritten atomically at most every interval seconds"""
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.written = 0.0
+
+    def event(self, progress, kind):
+        self.dump(progress)
+
+    def entry(self, progress, name, size, action):
+        if time.perf_counter() - self.written >= self.interval:
+            self.dump(progress)
+
+    def dump(self, progress):
+        snap = progress.snapshot()
+        stage = f'{{stage="{snap["stage"]}"}}'
+        lines = []
+        for metric, kind, help_text, value in (
+            ('rgss_entries_done', 'gauge', 'Entries processed in the current stage', snap['entries_done']),
+            ('rgss_entries_total', 'gauge', 'Entries to process in the current stage', snap['entries_total']),
+            ('rgss_bytes_done', 'gauge', 'Payload bytes processed in the current stage', snap['bytes_done']),
+            ('rgss_bytes_total', 'gauge', 'Payload bytes to process in the current stage', snap['bytes_total']),
+            ('rgss_throughput_bytes_per_second', 'gauge', 'Average rate of the current stage', snap['bytes_per_second']),
+            ('rgss_eta_seconds', 'gauge', 'Estimated time left in the current stage', snap['eta']),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}", f"{metric}{stage} {value}"]
+        lines += ["# HELP rgss_stage_seconds Time spent in each stage", "# TYPE rgss_stage_seconds gauge"]
+        lines += [f'rgss_stage_seconds{{stage="{name}"}} {seconds:.6f}' for name, seconds in snap['timings'].items()]
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+        self.written = time.perf_counter()
+
+class Progress:
+    """Progress and metrics hook for long loops.
+
+    A run goes through stages (index, unpack, pack, ...). Every entry done
+    updates the counters and is passed to the sinks, which decide what to
+    output; without sinks (--quiet) an entry costs two additions.
+    """
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self.timings = {}
+        self.stage = None
+        self.begin_stage(None)
+
+    def begin_stage(self, stage, entries=0, size=0):
+        if self.stage is not None:
+            self.end_stage()
+        self.stage = stage
+        self.entries_total = entries
+        self.bytes_total = size
+        self.entries_done = 0
+        self.bytes_done = 0
+        self.started = time.perf_counter()
+        if stage is not None:
+            for sink in self.sinks:
+                sink.event(self, 'begin')
+
+    def entry(self, name, size, action='done'):
+        self.entries_done += 1
+        self.bytes_done += size
+        for sink in self.sinks:
+            sink.entry(self, name, size, action)
+
+    def end_stage(self):
+        if self.stage is None:
+            return
+        self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.started
+        for sink in self.sinks:
+            sink.event(self, 'end')
+        self.stage = None
+
+    def close(self):
+        """End the current stage and close the sinks that hold a file"""
+        self.end_stage()
+        for sink in self.sinks:
+            if hasattr(sink, 'close'):
+                sink.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        left = self.bytes_total - self.bytes_done
+        return {
+            'stage': self.stage,
+            'entries_done': self.entries_done,
+            'entries_total': self.entries_total,
+            'bytes_done': self.bytes_done,
+            'bytes_total': self.bytes_total,
+            'elapsed': round(elapsed, 6),
+            'bytes_per_second': round(rate, 1),
+            'mb_per_second': round(rate / (1 << 20), 3),
+            'eta': round(left / rate, 3) if rate and left > 0 else 0.0,
+            'timings': {k: round(v, 6) for k, v in self.timings.items()},
+        }
+
+def console_progress(stream=None):
+    return Progress([ConsoleSink(stream)])
 
 class Entry:
     def __init__(self, name, data):
         self.name = name
         self.data = data
 
+class EntryIndex:
+    """Name lookups over an entry list: exact names by dict, prefixes by bisect"""
+    def __init__(self, entries):
+        self.by_name = {entry.name: entry for entry in entries}
+        self.names = sorted(self.by_name)
+
+    def get(self, name):
+        return self.by_name.get(name.replace('\\', '/'))
+
+    def with_prefix(self, prefix):
+        prefix = prefix.replace('\\', '/')
+        i = bisect_left(self.names, prefix)
+        while i < len(self.names) and self.names[i].startswith(prefix):
+            yield self.by_name[self.names[i]]
+            i += 1
+
 class RGSSArchive:
     def __init__(self, magic, version, entries, stream):
         self.magic = magic
         self.version = version
         self.entries = entries
         self.stream = stream
+        self.cache = BlockCache()
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None or len(self._index.by_name) != len(self.entries):
+            self._index = EntryIndex(self.entries)
+        return self._index
+
+    def _entry(self, entry):
+        if isinstance(entry, str):
+            name = entry
+            entry = self.index.get(name)
+            if entry is None:
+                raise FileNotFoundError(name)
+        return entry
+
+    def open_entry(self, entry, cached=True):
+        """File object reading the decrypted payload of entry (or entry name).
+
+        Cached readers go through self.cache, one-pass copies should pass
+        cached=False so they do not evict the hot blocks.
+        """
+        return EntryReader(self.stream, self._entry(entry).data, self.cache if cached else None)
+
+    def read(self, entry, offset=0, size=-1):
+        """Decrypted bytes of entry (or entry name), or of [offset, offset + size)"""
+        data = self._entry(entry).data
+        if size < 0:
+            size = data.size - offset
+        return read_payload(self.stream, data, offset, size, self.cache)
+
+    def map(self):
+        """Read payloads through a memory map of the archive file"""
+        if not isinstance(self.stream, mmap.mmap):
+            mapped = mmap.mmap(self.stream.fileno(), 0, access=mmap.ACCESS_READ)
+            self.stream.close()
+            self.stream = mapped
+        return self
 
     def close(self):
         if self.stream and not self.stream.closed:
@@ -97,13 +564,23 @@ class RGSSArchive:
         if version < 1 or version > 3:
             raise ValueError(E_INVALIDVER)
         
-        stream = open(location, 'wb+')
+        return cls.create_stream(open(location, 'wb+'), version)
+
+    @classmethod
+    def create_stream(cls, stream, version):
+        """New archive written to an open binary stream (header included).
+
+        Wrap streams that are not at position 0 or cannot tell(), such as
+        pipes, in a CountingWriter.
+        """
+        if version < 1 or version > 3:
+            raise ValueError(E_INVALIDVER)
         stream.write(b'RGSSAD\x00' + bytes([version]))
         magic = 0 if version == 3 else 0xDEADCAFE
         return cls(magic, version, [], stream)
 
     @classmethod
-    def open(cls, location):
+    def open(cls, location, cache_bytes=DEFAULT_CACHE_BYTES):
         stream = open(location, 'rb')
         try:
             header = stream.read(8)
@@ -113,18 +590,24 @@ class RGSSArchive:
             version = header[7]
             stream.seek(0)
             if version in (1, 2):
-                return cls.open_rgssad(stream, version)
+                archive = cls.open_rgssad(stream, version)
             elif version == 3:
-                return cls.open_rgss3a(stream, version)
+                archive = cls.open_rgss3a(stream, version)
             else:
                 raise ValueError(E_INVALIDVER)
         except Exception:
             stream.close()
             raise
+        archive.cache.max_bytes = cache_bytes
+        return archive
 
     @classmethod
     def open_rgssad(cls, stream, version):
+        # One key stream runs through the whole index: every header word and
+        # every name byte takes the next key. Payloads are coded from the key
+        # reached at their start, without advancing the index key.
         magic = 0xDEADCAFE
+        key = magic
         entries = []
         stream.seek(8)
 
@@ -132,23 +615,22 @@ class RGSSArchive:
             name_len = ru32(stream)
             if name_len is None:
                 break
-            name_len ^= advance_magic(magic)[0]
+            key, name_len = advance_magic(key)[1], name_len ^ key
+
+            name = read_until_full(stream, name_len)
+            if len(name) < name_len:
+                break
+            name, key = xor_name_rgssad(name, key)
 
-            name = bytearray()
-            for _ in range(name_len):
-                name_byte = stream.read(1)[0]
-                name_byte ^= advance_magic(magic)[0] & 0xFF
-                name.append(name_byte)
-            
             name = name.replace(b'\\', b'/').decode('utf-8', 'ignore')
             size = ru32(stream)
             if size is None:
                 break
-            size ^= advance_magic(magic)[0]
+            key, size = advance_magic(key)[1], size ^ key
 
             offset = stream.tell()
             stream.seek(size, 1)
-            entries.append(Entry(name, EntryData(offset, magic, size)))
+            entries.append(Entry(name, EntryData(offset, key, size)))
 
         stream.seek(0)
         return cls(magic, version, entries, stream)
@@ -187,57 +669,79 @@ class RGSSArchive:
         stream.seek(0)
         return cls(magic, version, entries, stream)
 
-    def write_entries(self, root):
+    def write_entries(self, root, progress=None, align=0, raw=None):
+        """Write entries read from the root folder, or from root(entry) if callable.
+
+        align > 1 starts every payload on a multiple of align (version 3 only,
+        v1/v2 payloads directly follow their header). raw(entry) may return a
+        (stream, EntryData) of already encrypted payload to copy as is, with
+        its start magic, instead of reading root (version 3 only, v1/v2 keys
+        follow from the index so they read root).
+        """
+        if not callable(root):
+            folder = root
+            root = lambda entry: open(os.path.join(folder, entry.name), 'rb')
+        if progress is None:
+            progress = console_progress()
+        progress.begin_stage('pack', len(self.entries), sum(e.data.size for e in self.entries))
         if self.version in (1, 2):
-            self.write_entries_rgssad(root)
+            if align > 1:
+                raise ValueError("payload alignment needs an RGSS3A (version 3) archive")
+            self.write_entries_rgssad(root, progress)
         elif self.version == 3:
-            self.write_entries_rgss3a(root)
+            self.write_entries_rgss3a(root, progress, align, raw)
         else:
             raise ValueError(E_INVALIDVER)
+        progress.end_stage()
 
-    def write_entries_rgssad(self, root):
+    def write_entries_rgssad(self, root, progress):
         coder = Coder()
+        key = self.magic
         for entry in self.entries:
-            print(f"Packing: {entry.name}")
             name = entry.name.replace('/', '\\').encode('utf-8')
-            name_len = len(name)
-            wu32(self.stream, name_len ^ advance_magic(self.magic)[0])
+            wu32(self.stream, len(name) ^ key)
+            key = advance_magic(key)[1]
 
-            encrypted_name = bytearray(name)
-            for i in range(len(encrypted_name)):
-                encrypted_name[i] ^= advance_magic(self.magic)[0] & 0xFF
+            encrypted_name, key = xor_name_rgssad(name, key)
             self.stream.write(encrypted_name)
 
-            size = entry.data.size ^ advance_magic(self.magic)[0]
-            wu32(self.stream, size)
+            wu32(self.stream, entry.data.size ^ key)
+            key = advance_magic(key)[1]
 
-            with open(os.path.join(root, entry.name), 'rb') as f:
-                coder.copy(f, self.stream, EntryData(0, self.magic, entry.data.size))
+            entry.data.offset = self.stream.tell()
+            entry.data.magic = key
+            with root(entry) as f:
+                coder.copy(f, self.stream, EntryData(0, key, entry.data.size))
+            progress.entry(entry.name, entry.data.size)
 
-    def write_entries_rgss3a(self, root):
+    def write_entries_rgss3a(self, root, progress, align=0, raw=None):
         # Calculate entry metadata
+        names = [entry.name.replace('/', '\\').encode('utf-8') for entry in self.entries]
         off = 8 + 4  # Header + Magic
-        for entry in self.entries:
-            off += 16 + len(entry.name)
+        for name in names:
+            off += 16 + len(name)
         off += 4
 
         # Update entry offsets and magic
-        for entry in self.entries:
+        sources = [raw(entry) if raw else None for entry in self.entries]
+        for entry, source in zip(self.entries, sources):
+            if align > 1:
+                off += -off % align
             entry.data.offset = off
             off += entry.data.size
-            entry.data.magic = 0xDEADCAFE
+            entry.data.magic = source[1].magic if source else 0xDEADCAFE
 
         # Write metadata
         wu32(self.stream, self.magic)
         self.magic = (self.magic * 9 + 3) & 0xFFFFFFFF
 
-        for entry in self.entries:
+        for entry, name in zip(self.entries, names):
             wu32(self.stream, entry.data.offset ^ self.magic)
             wu32(self.stream, entry.data.size ^ self.magic)
             wu32(self.stream, entry.data.magic ^ self.magic)
-            wu32(self.stream, len(entry.name) ^ self.magic)
+            wu32(self.stream, len(name) ^ self.magic)
 
-            encrypted_name = bytearray(entry.name.replace('/', '\\').encode('utf-8'))
+            encrypted_name = bytearray(name)
             for i in range(len(encrypted_name)):
                 encrypted_name[i] ^= (self.magic >> ((i % 4) * 8)) & 0xFF
             self.stream.write(encrypted_name)
@@ -246,10 +750,444 @@ class RGSSArchive:
 
         # Write file data
         coder = Coder()
-        for entry in self.entries:
-            print(f"Packing: {entry.name}")
-            with open(os.path.join(root, entry.name), 'rb') as f:
+        for entry, source in zip(self.entries, sources):
+            padding = entry.data.offset - self.stream.tell()
+            if padding > 0:
+                self.stream.write(bytes(padding))
+            if source:
+                stream, data = source
+                stream.seek(data.offset)
+                remaining = data.size
+                while remaining > 0:
+                    chunk = read_until_full(stream, min(remaining, 1 << 16))
+                    if not chunk:
+                        raise ValueError(f"{entry.name}: source payload is truncated")
+                    self.stream.write(chunk)
+                    remaining -= len(chunk)
+                progress.entry(entry.name, entry.data.size, 'copy')
+                continue
+            with root(entry) as f:
                 coder.copy(f, self.stream, EntryData(0, entry.data.magic, entry.data.size))
+            progress.entry(entry.name, entry.data.size)
+
+class ArchiveWriter:
+    """Build an archive from bytes, file objects or chunk iterables, with no
+    temporary files.
+
+    Entries are only collected by add(); close() (or leaving the with block)
+    writes the index from the declared sizes, then streams every source
+    through the encryption into out, in the order added. out is a path or a
+    writable binary stream, which does not need to be seekable.
+
+        with ArchiveWriter("Game.rgss3a", 3) as writer:
+            writer.add("Data/System.rvdata2", marshal_bytes)
+            writer.add("Graphics/Pictures/Title.png", open("title.png", "rb"))
+            writer.add("Audio/BGM/Theme.ogg", generate_chunks(), size=theme_size)
+    """
+    def __init__(self, out, version=3, align=0, progress=None):
+        self.owned = isinstance(out, (str, os.PathLike))
+        stream = open(out, 'wb') if self.owned else out
+        try:
+            self.archive = RGSSArchive.create_stream(CountingWriter(stream), version)
+        except Exception:
+            if self.owned:
+                stream.close()
+            raise
+        self.align = align
+        self.progress = progress or Progress()
+        self.sources = {}
+        self.written = False
+
+    @property
+    def entries(self):
+        return self.archive.entries
+
+    def add(self, name, source, size=None):
+        """Queue an entry. source is bytes-like, a binary file object (read
+        from its current position) or an iterable of byte chunks; size is
+        required for chunk iterables and unseekable files."""
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = memoryview(source).cast('B')
+            if size is None:
+                size = len(source)
+        elif size is None:
+            if not (hasattr(source, 'read') and source.seekable()):
+                raise ValueError(f"{name}: size is required for streamed sources")
+            pos = source.tell()
+            size = source.seek(0, 2) - pos
+            source.seek(pos)
+        entry = Entry(name.replace('\\', '/'), EntryData(size=size))
+        self.archive.entries.append(entry)
+        self.sources[id(entry)] = source
+        return entry
+
+    def open_source(self, entry):
+        source = self.sources.pop(id(entry))
+        if isinstance(source, memoryview):
+            chunks = (source,)
+        elif hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(1 << 16), b'')
+        else:
+            chunks = source
+        return ChunkReader(chunks, entry.name, entry.data.size)
+
+    def close(self):
+        """Write the archive (once) and close out if it was given as a path"""
+        try:
+            if not self.written:
+                self.written = True
+                self.archive.write_entries(self.open_source, self.progress, self.align)
+            self.archive.stream.flush()
+        finally:
+            if self.owned:
+                self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        elif self.owned:
+            self.archive.close()
+
+class ArchiveFS:
+    """Read-only directory view of an archive, without extracting it.
+
+    Paths use '/' and fall back to a case-insensitive match, like the game
+    does on Windows. listdir/stat/walk/open mirror their os counterparts.
+    """
+    def __init__(self, archive, cache_bytes=DEFAULT_CACHE_BYTES):
+        if isinstance(archive, str):
+            archive = RGSSArchive.open(archive, cache_bytes)
+        self.archive = archive
+        self.cache = archive.cache
+        self.mtime = os.fstat(archive.stream.fileno()).st_mtime
+
+        self.files = {}
+        self.dirs = {'': set()}
+        for entry in archive.entries:
+            path = entry.name.strip('/')
+            self.files[path] = entry
+            parent, _, child = path.rpartition('/')
+            while True:
+                self.dirs.setdefault(parent, set()).add(child)
+                if not parent:
+                    break
+                parent, _, child = parent.rpartition('/')
+        self.lower = {p.lower(): p for p in list(self.files) + list(self.dirs)}
+
+    def __reduce__(self):
+        # Process pool workers reopen the archive instead of sharing the handle
+        return (ArchiveFS, (self.archive.stream.name, self.cache.max_bytes))
+
+    def close(self):
+        self.archive.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def resolve(self, path):
+        """Archive path for path, or None"""
+        path = path.replace('\\', '/').strip('/')
+        while path.startswith('./'):
+            path = path[2:]
+        if path == '.':
+            path = ''
+        if path in self.files or path in self.dirs:
+            return path
+        return self.lower.get(path.lower())
+
+    def exists(self, path):
+        return self.resolve(path) is not None
+
+    def isfile(self, path):
+        return self.resolve(path) in self.files
+
+    def isdir(self, path):
+        return self.resolve(path) in self.dirs
+
+    def listdir(self, path=''):
+        resolved = self.resolve(path)
+        if resolved not in self.dirs:
+            raise NotADirectoryError(path) if resolved in self.files else FileNotFoundError(path)
+        return sorted(self.dirs[resolved])
+
+    def stat(self, path):
+        resolved = self.resolve(path)
+        if resolved is None:
+            raise FileNotFoundError(path)
+        if resolved in self.files:
+            mode, size = stat.S_IFREG | 0o444, self.files[resolved].data.size
+        else:
+            mode, size = stat.S_IFDIR | 0o555, 0
+        return os.stat_result((mode, 0, 0, 1, 0, 0, size, self.mtime, self.mtime, self.mtime))
+
+    def getsize(self, path):
+        return self.stat(path).st_size
+
+    def getmtime(self, path):
+        return self.stat(path).st_mtime
+
+    def walk(self, top=''):
+        top = self.resolve(top)
+        if top not in self.dirs:
+            return
+        pending = [top]
+        while pending:
+            current = pending.pop()
+            children = sorted(self.dirs[current])
+            prefix = current + '/' if current else ''
+            dirnames = [c for c in children if prefix + c in self.dirs]
+            filenames = [c for c in children if prefix + c in self.files]
+            yield current, dirnames, filenames
+            pending.extend(prefix + d for d in reversed(dirnames))
+
+    def glob(self, pattern):
+        """File paths matching pattern, '*' stays within a folder and '**' spans folders"""
+        parts = pattern.replace('\\', '/').strip('/').lower().split('/')
+        return sorted(p for p in self.files if self._match(p.lower().split('/'), parts))
+
+    def _match(self, names, parts):
+        if not parts:
+            return not names
+        if parts[0] == '**':
+            return any(self._match(names[i:], parts[1:]) for i in range(len(names) + 1))
+        return bool(names) and fnmatch.fnmatchcase(names[0], parts[0]) and self._match(names[1:], parts[1:])
+
+    def entry(self, path):
+        resolved = self.resolve(path)
+        if resolved not in self.files:
+            raise IsADirectoryError(path) if resolved in self.dirs else FileNotFoundError(path)
+        return self.files[resolved]
+
+    def open(self, path, mode='rb'):
+        if mode not in ('r', 'rb'):
+            raise ValueError(f"ArchiveFS is read-only, cannot open with mode {mode!r}")
+        return BufferedReader(self.archive.open_entry(self.entry(path)), BLOCK_SIZE)
+
+    def read(self, path, offset=0, size=-1):
+        """Decrypted bytes of a file, or of the range [offset, offset + size)"""
+        return self.archive.read(self.entry(path), offset, size)
+
+HTTP_REASONS = {200: 'OK', 206: 'Partial Content', 400: 'Bad Request', 404: 'Not Found',
+                405: 'Method Not Allowed', 416: 'Range Not Satisfiable'}
+
+class HTTPError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+def parse_range(header, size):
+    """(start, end) for a "bytes=a-b" Range header, end excluded"""
+    unsatisfiable = {'Content-Range': f"bytes */{size}"}  # RFC 7233 4.4
+    unit, _, spec = header.partition('=')
+    first, dash, last = spec.strip().partition('-')
+    if unit.strip() != 'bytes' or not dash or ',' in spec:
+        raise HTTPError(416, f"Unsupported range {header!r}", unsatisfiable)
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        raise HTTPError(416, f"Invalid range {header!r}", unsatisfiable)
+    if start >= end:
+        raise HTTPError(416, f"Range {header!r} outside of {size} bytes", unsatisfiable)
+    return start, end
+
+def archive_names(locations):
+    """{URL name: path} of archives: file names, or paths below their common
+    folder when two file names are the same"""
+    paths = list(dict.fromkeys(os.path.abspath(location) for location in locations))
+    names = [os.path.basename(path) for path in paths]
+    if len(set(names)) < len(names):
+        root = os.path.commonpath([os.path.dirname(path) for path in paths])
+        names = [os.path.relpath(path, root).replace(os.sep, '/') for path in paths]
+    return dict(zip(names, paths))
+
+class ArchiveServer:
+    """Local HTTP/1.1 API over open archives, for `dec.py serve`.
+
+    GET /                               archives being served
+    GET /list/<archive>[?prefix=P]      entry names and sizes
+    GET /stat/<archive>/<path>          size, offset and mtime of an entry
+    GET /read/<archive>/<path>          payload, honours Range: bytes=a-b
+                                        and ?offset=N&size=N
+    GET /stats                          block cache counters
+
+    Connections are kept alive, payloads are decrypted block by block as
+    they are written so large reads do not hold up other clients.
+    """
+    def __init__(self, locations, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.archives = {}
+        for name, location in archive_names(locations).items():
+            fs = ArchiveFS(location, cache_bytes)
+            fs.archive.map()
+            self.archives[name] = fs
+        self.requests = 0
+
+    def close(self):
+        for fs in self.archives.values():
+            fs.close()
+
+    def archive(self, name):
+        fs = self.archives.get(name)
+        if fs is None:
+            raise HTTPError(404, f"No archive named {name!r}")
+        return fs
+
+    def split_name(self, rest):
+        """(archive name, path) of "<archive>/<path>", archive names may hold '/'"""
+        for name in sorted(self.archives, key=len, reverse=True):
+            if rest == name or rest.startswith(name + '/'):
+                return name, rest[len(name) + 1:]
+        name, _, path = rest.partition('/')
+        return name, path
+
+    def entry(self, fs, path):
+        try:
+            return fs.entry(path)
+        except (FileNotFoundError, IsADirectoryError):
+            raise HTTPError(404, f"No entry named {path!r}")
+
+    def route(self, target, headers):
+        """(status, headers, body) where body is bytes or a (fs, entry, start, end) read"""
+        url = urlsplit(target)
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        command, _, rest = unquote(url.path).strip('/').partition('/')
+        name, path = self.split_name(rest)
+
+        if command == '':
+            return 200, {}, {"archives": sorted(self.archives)}
+        if command == 'stats':
+            return 200, {}, {"requests": self.requests,
+                             "archives": {n: fs.cache.stats() for n, fs in self.archives.items()}}
+        if command == 'list':
+            fs = self.archive(name)
+            entries = fs.archive.index.with_prefix(query.get('prefix', path))
+            return 200, {}, [{"name": e.name, "size": e.data.size} for e in entries]
+        if command == 'stat':
+            fs = self.archive(name)
+            entry = self.entry(fs, path)
+            return 200, {}, {"name": entry.name, "size": entry.data.size,
+                             "offset": entry.data.offset, "mtime": fs.mtime}
+        if command == 'read':
+            fs = self.archive(name)
+            entry = self.entry(fs, path)
+            size = entry.data.size
+            if 'range' in headers:
+                start, end = parse_range(headers['range'], size)
+                return 206, {'Content-Range': f"bytes {start}-{end - 1}/{size}"}, (fs, entry, start, end)
+            try:
+                start = int(query.get('offset', 0))
+                end = size if 'size' not in query else min(start + int(query['size']), size)
+            except ValueError:
+                raise HTTPError(400, "offset and size must be integers")
+            if start < 0 or end < start:
+                raise HTTPError(400, "Invalid offset or size")
+            return 200, {}, (fs, entry, min(start, size), end)
+        raise HTTPError(404, f"Unknown command {command!r}")
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+
+                parts = request_line.decode('latin-1').split()
+                keep_alive = headers.get('connection', '').lower() != 'close' and parts[-1:] != ['HTTP/1.0']
+                self.requests += 1
+                try:
+                    if len(parts) != 3:
+                        raise HTTPError(400, "Malformed request line")
+                    if parts[0] not in ('GET', 'HEAD'):
+                        raise HTTPError(405, f"Method {parts[0]} not allowed")
+                    status, extra, body = self.route(parts[1], headers)
+                except HTTPError as e:
+                    status, extra, body = e.status, dict(e.headers), {"error": str(e)}
+
+                if isinstance(body, tuple):
+                    fs, entry, start, end = body
+                    extra['Content-Type'] = 'application/octet-stream'
+                    extra['Accept-Ranges'] = 'bytes'
+                    length = end - start
+                else:
+                    body = json.dumps(body).encode('utf-8')
+                    extra['Content-Type'] = 'application/json'
+                    length = len(body)
+
+                head = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", f"Content-Length: {length}",
+                        f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head += [f"{k}: {v}" for k, v in extra.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+
+                if parts[0] == 'HEAD':
+                    pass
+                elif isinstance(body, tuple):
+                    pos = start
+                    while pos < end:
+                        chunk_end = min(pos - pos % BLOCK_SIZE + BLOCK_SIZE, end)
+                        writer.write(fs.archive.read(entry, pos, chunk_end - pos))
+                        pos = chunk_end
+                        await writer.drain()
+                else:
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def run(self, socket_path=None, host='127.0.0.1', port=8765):
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            server = await asyncio.start_unix_server(self.handle, socket_path)
+            where = f"unix:{socket_path}"
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+            where = "http://{}:{}".format(*server.sockets[0].getsockname()[:2])
+        print(f"Serving {len(self.archives)} archive(s) on {where}", flush=True)
+
+        # Stop on SIGTERM as on Ctrl-C, so the socket file gets removed
+        stopped = asyncio.Event()
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+        except NotImplementedError:
+            pass  # Windows
+        async with server:
+            await stopped.wait()
+
+def serve(locations, socket_path=None, host='127.0.0.1', port=8765, cache_bytes=DEFAULT_CACHE_BYTES):
+    try:
+        server = ArchiveServer(locations, cache_bytes)
+    except Exception as e:
+        print(f"FAILED: unable to open archive. {e}")
+        return 1
+    try:
+        asyncio.run(server.run(socket_path, host, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
 
 def usage():
     print("""Extract rgssad/rgss2a/rgss3a files.
@@ -257,14 +1195,155 @@ Commands:
     help
     version
     list        <archive>
-    unpack      <archive> <folder> [<filter>]
-    pack        <folder> <archive> [<version>]""")
+    unpack      <archive> <folder> [<filter>] [<selection>] [--incremental [--compare]] [<progress>]
+    pack        <folder> <archive> [<version>] [--layout walk|grouped|trace] [--trace FILE] [--align N] [<progress>]
+    verify      <archive> [--jobs N] [--output FILE]
+    convert     <archive> <archive> [<version>]
+    export      <archive> <file.tar|file.tgz|file.zip|-> [<filter>] [<selection>] [--format F] [--deflate]
+    diff        <old archive> <new archive> [--patch PATCH.rgss3a] [--jobs N]
+    apply       <old archive> <patch archive> <new archive> [<progress>]
+    serve       <archive>... [--socket PATH | --host H --port N] [--cache-mb N]
+    batch       <archive|glob>... --out <folder> [--jobs N]
+    batch       --from-list FILE [--jobs N]
+
+Selection options:
+    --prefix P[,P...]       only entries under these name prefixes (e.g. Data/)
+    --ext E[,E...]          only these extensions (e.g. png,ogg)
+    --min-size N            only entries of at least N bytes
+    --max-size N            only entries of at most N bytes
+    --from-list FILE        only the entry names listed in FILE, one per line
+
+Unpack options:
+    --incremental           skip files already present with the same size
+    --compare               with --incremental, also compare their content
+
+Progress options (unpack, pack, convert, export):
+    --quiet                 no line per entry
+    --progress-jsonl FILE   append JSON progress events to FILE (- for stderr)
+    --metrics-prom FILE     keep a Prometheus textfile with progress metrics""")
+
+def parse_options(args, valued=()):
+    """Split "--name value", "--name=value" and "--flag" options from positional args"""
+    positional = []
+    options = {}
+    it = iter(args)
+    for arg in it:
+        if not arg.startswith('--'):
+            positional.append(arg)
+            continue
+        name, eq, value = arg[2:].partition('=')
+        if not eq:
+            value = next(it, None) if name in valued else True
+        options[name] = value
+    return positional, options
+
+SELECTION_OPTIONS = ('prefix', 'ext', 'min-size', 'max-size', 'from-list')
+PROGRESS_OPTIONS = ('progress-jsonl', 'metrics-prom')
+
+def progress_from_options(options, stream=None):
+    """Progress for --quiet, --progress-jsonl FILE|- and --metrics-prom FILE"""
+    sinks = []
+    if not options.get('quiet'):
+        sinks.append(ConsoleSink(stream))
+    if options.get('progress-jsonl'):
+        path = options['progress-jsonl']
+        if path == '-':
+            sinks.append(JSONLSink(sys.stderr))
+        else:
+            sinks.append(JSONLSink(open(path, 'a', encoding='utf-8'), owned=True))
+    if options.get('metrics-prom'):
+        sinks.append(PrometheusSink(options['metrics-prom']))
+    return Progress(sinks)
+
+def select_entries(archive, pattern=None, prefixes=None, extensions=None,
+                   min_size=None, max_size=None, names=None):
+    """Entries matching every given criterion, in payload order"""
+    index = archive.index
+    if names is not None:
+        selected = []
+        for name in names:
+            entry = index.get(name)
+            if entry is None:
+                print(f"Not found: {name}")
+            else:
+                selected.append(entry)
+    elif prefixes:
+        selected = {id(e): e for p in prefixes for e in index.with_prefix(p)}.values()
+    else:
+        selected = archive.entries
+
+    if extensions:
+        extensions = {'.' + ext.lower().lstrip('.') for ext in extensions}
+        selected = [e for e in selected if os.path.splitext(e.name)[1].lower() in extensions]
+    if min_size is not None:
+        selected = [e for e in selected if e.data.size >= min_size]
+    if max_size is not None:
+        selected = [e for e in selected if e.data.size <= max_size]
+    if pattern not in (None, '', '.*'):
+        search = re.compile(pattern).search
+        selected = [e for e in selected if search(e.name)]
+
+    return sorted(selected, key=lambda e: e.data.offset)
+
+def selection_from_options(options):
+    """select_entries() keyword arguments from parsed command line options"""
+    selection = {}
+    if options.get('prefix'):
+        selection['prefixes'] = options['prefix'].split(',')
+    if options.get('ext'):
+        selection['extensions'] = options['ext'].split(',')
+    if options.get('min-size'):
+        selection['min_size'] = int(options['min-size'])
+    if options.get('max-size'):
+        selection['max_size'] = int(options['max-size'])
+    if options.get('from-list'):
+        with open(options['from-list'], 'r', encoding='utf-8') as f:
+            selection['names'] = [line.strip() for line in f if line.strip()]
+    return selection
 
 def list_archive(archive):
     for entry in archive.entries:
         print(f"{entry.name}: EntryData(size={entry.data.size}, offset={entry.data.offset}, magic={entry.data.magic})")
 
-def pack(src, out, version):
+PACK_LAYOUTS = ('walk', 'grouped', 'trace')
+
+def grouped_key(entry):
+    # Data/ first (read at boot), then folder by folder, extension by extension
+    folder, _, filename = entry.name.lower().rpartition('/')
+    return (folder.split('/')[0] != 'data', folder, os.path.splitext(filename)[1], filename)
+
+def read_trace(path):
+    """Entry names in first-access order from a trace file, one name per line"""
+    names = []
+    seen = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            name = line.strip().replace('\\', '/').lower()
+            if name and not name.startswith('#') and name not in seen:
+                seen.add(name)
+                names.append(name)
+    return names
+
+def order_entries(entries, layout='walk', trace=None):
+    """Entries in payload order for a pack layout.
+
+    walk keeps the os.walk order, grouped sorts with grouped_key, trace puts
+    the entries named in the trace first, in trace order, then the others
+    grouped.
+    """
+    if layout == 'walk':
+        return list(entries)
+    if layout not in PACK_LAYOUTS:
+        raise ValueError(f"unknown layout {layout!r} (use {', '.join(PACK_LAYOUTS)})")
+    ordered = sorted(entries, key=grouped_key)
+    if layout == 'trace':
+        if trace is None:
+            raise ValueError("the trace layout needs a trace file")
+        rank = {name: i for i, name in enumerate(trace)}
+        ordered.sort(key=lambda e: rank.get(e.name.lower(), len(rank)))  # stable: the rest stays grouped
+    return ordered
+
+def pack(src, out, version, progress=None, layout='walk', trace=None, align=0):
     def collect_files(root):
         entries = []
         for dirpath, _, filenames in os.walk(root):
@@ -278,6 +1357,15 @@ def pack(src, out, version):
     if not os.path.isdir(src):
         print("FAILED: source is not a directory.")
         return
+    if align > 1 and version != 3:
+        print("FAILED: --align needs an RGSS3A (version 3) archive.")
+        return
+
+    try:
+        entries = order_entries(collect_files(src), layout, trace)
+    except ValueError as e:
+        print(f"FAILED: Invalid layout. {e}")
+        return
 
     try:
         archive = RGSSArchive.create(out, version)
@@ -285,33 +1373,491 @@ def pack(src, out, version):
         print(f"FAILED: unable to create output file. {e}")
         return
 
-    archive.entries = collect_files(src)
+    archive.entries = entries
     try:
-        archive.write_entries(src)
+        archive.write_entries(src, progress, align)
     except Exception as e:
         print(f"FAILED: unable to write archive. {e}")
 
-def unpack(archive, dir, filter_pattern):
-    os.makedirs(dir, exist_ok=True)
+ARCHIVE_VERSIONS = {'.rgssad': 1, '.rgss2a': 2, '.rgss3a': 3}
+
+def same_file(location, other):
+    """True if both paths name one file (other may not exist yet)"""
+    return os.path.exists(other) and os.path.samefile(location, other)
+
+def convert(archive, out, version=None, progress=None):
+    """Re-encrypt every entry of archive straight into a new archive"""
+    if same_file(archive.stream.name, out):
+        print("FAILED: the output must not overwrite the input archive.")
+        return
+    if version is None:
+        version = ARCHIVE_VERSIONS.get(os.path.splitext(out)[1].lower(), 3)
+
+    try:
+        target = RGSSArchive.create(out, version)
+    except Exception as e:
+        print(f"FAILED: unable to create output file. {e}")
+        return
+
+    # Same entries in payload order, so the source is read front to back
+    sources = {}
+    for entry in sorted(archive.entries, key=lambda e: e.data.offset):
+        copy = Entry(entry.name, EntryData(size=entry.data.size))
+        sources[id(copy)] = entry
+        target.entries.append(copy)
+
+    with target:
+        try:
+            target.write_entries(lambda entry: archive.open_entry(sources[id(entry)], cached=False), progress)
+        except Exception as e:
+            print(f"FAILED: unable to write archive. {e}")
+
+EXPORT_FORMATS = {'.tar': 'tar', '.tgz': 'tgz', '.gz': 'tgz', '.zip': 'zip'}
+EXPORT_CHUNK = 1 << 16
+
+def export(archive, out, fmt=None, filter_pattern='.*', deflate=False, progress=None, **selection):
+    """Stream decrypted entries into a tar or zip file, out may be '-' for stdout"""
     try:
-        pattern = re.compile(filter_pattern)
+        entries = select_entries(archive, filter_pattern, **selection)
     except re.error:
         print(f"FAILED: Invalid regex filter: {filter_pattern}")
         return
 
+    if fmt is None:
+        fmt = 'tar' if out == '-' else EXPORT_FORMATS.get(os.path.splitext(out)[1].lower())
+    if fmt not in ('tar', 'tgz', 'zip'):
+        print(f"FAILED: unknown export format for {out} (use --format tar|tgz|zip)")
+        return
+
+    if progress is None:
+        progress = console_progress(sys.stderr)
+    progress.begin_stage('export', len(entries), sum(e.data.size for e in entries))
+    mtime = os.fstat(archive.stream.fileno()).st_mtime
+    dest = sys.stdout.buffer if out == '-' else open(out, 'wb')
+    try:
+        if fmt == 'zip':
+            method = zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED
+            with zipfile.ZipFile(dest, 'w', compression=method) as zf:
+                for entry in entries:
+                    info = zipfile.ZipInfo(entry.name, time.localtime(mtime)[:6])
+                    info.compress_type = method
+                    info.file_size = entry.data.size
+                    with zf.open(info, 'w', force_zip64=entry.data.size >= zipfile.ZIP64_LIMIT) as f:
+                        shutil.copyfileobj(archive.open_entry(entry, cached=False), f, EXPORT_CHUNK)
+                    progress.entry(entry.name, entry.data.size)
+        else:
+            # Stream mode: no seeking, so stdout and pipes work too. tarfile
+            # copies members 16 KiB at a time unless told otherwise.
+            with tarfile.open(fileobj=dest, mode='w|gz' if fmt == 'tgz' else 'w|',
+                              bufsize=EXPORT_CHUNK, copybufsize=EXPORT_CHUNK) as tar:
+                for entry in entries:
+                    info = tarfile.TarInfo(entry.name)
+                    info.size = entry.data.size
+                    info.mtime = mtime
+                    tar.addfile(info, archive.open_entry(entry, cached=False))
+                    progress.entry(entry.name, entry.data.size)
+    finally:
+        if out == '-':
+            dest.flush()
+        else:
+            dest.close()
+    progress.end_stage()
+
+def same_content(coder, archive, entry, path):
+    """Compare a decrypted entry against an existing file of the same size"""
+    with open(path, 'rb') as existing:
+        for chunk in coder.chunks(archive.stream, entry.data):
+            if existing.read(len(chunk)) != chunk:
+                return False
+    return True
+
+def check_layout(archive, file_size):
+    """(entry, problem) pairs for payloads outside the file or overlapping another"""
+    problems = []
+    last = None
+    for entry in sorted(archive.entries, key=lambda e: e.data.offset):
+        start = entry.data.offset
+        end = start + entry.data.size
+        if entry.data.size and start >= file_size:
+            problems.append((entry, "out of bounds"))
+        elif end > file_size:
+            problems.append((entry, f"truncated ({end - file_size} bytes missing)"))
+        if last is not None and start < last.data.offset + last.data.size and entry.data.size:
+            problems.append((entry, f"overlaps {last.name}"))
+        if last is None or end > last.data.offset + last.data.size:
+            last = entry
+    return problems
+
+def hash_entries(location, items):
+    """(crc32, sha256, bytes read) of each decrypted (offset, magic, size) payload"""
+    results = []
     coder = Coder()
+    with open(location, 'rb') as stream:
+        for offset, magic, size in items:
+            crc = 0
+            sha = hashlib.sha256()
+            read = 0
+            for chunk in coder.chunks(stream, EntryData(offset, magic, size)):
+                crc = zlib.crc32(chunk, crc)
+                sha.update(chunk)
+                read += len(chunk)
+            results.append((crc, sha.hexdigest(), read))
+    return results
+
+def split_work(entries, parts):
+    """Split entries (in payload order) into up to parts runs of similar byte size"""
+    entries = sorted(entries, key=lambda e: e.data.offset)
+    target = sum(e.data.size for e in entries) / max(parts, 1)
+    runs = [[]]
+    total = 0
+    for entry in entries:
+        if runs[-1] and total >= target:
+            runs.append([])
+            total = 0
+        runs[-1].append(entry)
+        total += entry.data.size
+    return [run for run in runs if run]
+
+def hash_payloads(sources, jobs=None):
+    """{id(entry): (crc32, sha256, bytes read)} for (location, entries) sources, hashed in parallel"""
+    jobs = jobs or os.cpu_count() or 1
+    runs = [(location, run) for location, entries in sources for run in split_work(entries, jobs * 4)]
+    locations = [location for location, _ in runs]
+    work = [[(e.data.offset, e.data.magic, e.data.size) for e in run] for _, run in runs]
+    if jobs == 1:
+        hashed = map(hash_entries, locations, work)
+    else:
+        pool = ProcessPoolExecutor(max_workers=jobs)
+        hashed = pool.map(hash_entries, locations, work)
+
+    digests = {}
+    try:
+        for (_, run), results in zip(runs, hashed):
+            for entry, result in zip(run, results):
+                digests[id(entry)] = result
+    finally:
+        if jobs != 1:
+            pool.shutdown()
+    return digests
+
+def verify(archive, location, out=sys.stdout, jobs=None):
+    """Write a CRC32/SHA-256 manifest of every entry, return the number of problems"""
+    problems = {}
+    for entry, problem in check_layout(archive, os.path.getsize(location)):
+        problems.setdefault(id(entry), []).append(problem)
+
+    digests = hash_payloads([(location, archive.entries)], jobs)
+    total = 0
     for entry in archive.entries:
-        if not pattern.search(entry.name):
-            continue
+        crc, sha, read = digests[id(entry)]
+        if read < entry.data.size and id(entry) not in problems:
+            problems[id(entry)] = [f"short read ({read} of {entry.data.size} bytes)"]
+        flags = ''.join(f"  ! {p}" for p in problems.get(id(entry), []))
+        out.write(f"{crc:08x}  {sha}  {entry.data.size:>10}  {entry.name}{flags}\n")
+        total += entry.data.size
+
+    count = sum(len(p) for p in problems.values())
+    print(f"Verified {len(archive.entries)} entries ({total} bytes), {count} problems", file=sys.stderr)
+    return count
+
+def diff_archives(old, old_location, new, new_location, jobs=None):
+    """(added, removed, changed) entries from old to new.
+
+    Entries are matched by name. A new size is a change without reading
+    anything, only entries whose size is the same get their payloads hashed.
+    added and changed are entries of new, in its order, removed are of old.
+    """
+    added, changed, same_size = [], set(), []
+    for entry in new.entries:
+        before = old.index.get(entry.name)
+        if before is None:
+            added.append(entry)
+        elif before.data.size != entry.data.size:
+            changed.add(id(entry))
+        else:
+            same_size.append((before, entry))
+    names = set(entry.name for entry in new.entries)
+    removed = [entry for entry in old.entries if entry.name not in names]
+
+    if same_size:
+        digests = hash_payloads([(old_location, [before for before, _ in same_size]),
+                                 (new_location, [after for _, after in same_size])], jobs)
+        changed.update(id(after) for before, after in same_size
+                       if digests[id(before)][1] != digests[id(after)][1])
+    return added, removed, [entry for entry in new.entries if id(entry) in changed]
+
+PATCH_MANIFEST = '.patch.json'
+
+def write_patch(old, old_location, new, out, added, changed, removed, progress=None):
+    """Write a delta archive: the added and changed entries of new plus a manifest.
+
+    The patch is always RGSS3A, so payloads are copied from new still
+    encrypted. The manifest lists the removed entries and every entry of new
+    with its size, in order, so apply_patch can rebuild new from old.
+    """
+    manifest = {
+        'format': 1,
+        'version': new.version,
+        'base': {'entries': len(old.entries), 'size': os.path.getsize(old_location)},
+        'entries': [[entry.name, entry.data.size] for entry in new.entries],
+        'removed': [entry.name for entry in removed],
+    }
+    blob = json.dumps(manifest, indent=1).encode('utf-8')
+
+    try:
+        patch = RGSSArchive.create(out, 3)
+    except Exception as e:
+        print(f"FAILED: unable to create output file. {e}")
+        return
+
+    sources = {}
+    for entry in sorted(added + changed, key=lambda e: e.data.offset):
+        copy = Entry(entry.name, EntryData(size=entry.data.size))
+        sources[id(copy)] = entry
+        patch.entries.append(copy)
+    patch.entries.append(Entry(PATCH_MANIFEST, EntryData(size=len(blob))))
+
+    with patch:
+        try:
+            patch.write_entries(lambda entry: BytesIO(blob), progress,
+                                raw=lambda entry: (new.stream, sources[id(entry)].data) if id(entry) in sources else None)
+        except Exception as e:
+            print(f"FAILED: unable to write patch. {e}")
+
+def apply_patch(old, old_location, patch, out, progress=None):
+    """Rebuild the new archive from old and a patch made by write_patch.
+
+    Unchanged entries are copied from old and patched ones from the patch,
+    both still encrypted, when the output is RGSS3A. Returns False if the
+    patch does not apply.
+    """
+    try:
+        manifest = json.loads(patch.read(PATCH_MANIFEST))
+    except FileNotFoundError:
+        print(f"FAILED: not a patch archive (no {PATCH_MANIFEST}).")
+        return False
+    base = manifest['base']
+    if (base['entries'], base['size']) != (len(old.entries), os.path.getsize(old_location)):
+        print(f"FAILED: the patch was made for another archive ({base['entries']} entries, {base['size']} bytes).")
+        return False
+
+    sources = {}
+    entries = []
+    for name, size in manifest['entries']:
+        archive = patch if patch.index.get(name) else old
+        source = archive.index.get(name)
+        if source is None or source.data.size != size:
+            print(f"FAILED: {name} is missing or has another size in the base archive.")
+            return False
+        copy = Entry(name, EntryData(size=size))
+        sources[id(copy)] = (archive, source)
+        entries.append(copy)
+
+    try:
+        target = RGSSArchive.create(out, manifest['version'])
+    except Exception as e:
+        print(f"FAILED: unable to create output file. {e}")
+        return False
+    target.entries = entries
+
+    def root(entry):
+        archive, source = sources[id(entry)]
+        return archive.open_entry(source, cached=False)
+
+    def raw(entry):
+        archive, source = sources[id(entry)]
+        return archive.stream, source.data
+
+    with target:
+        try:
+            target.write_entries(root, progress, raw=raw)
+        except Exception as e:
+            print(f"FAILED: unable to write archive. {e}")
+            return False
+    return True
 
-        print(f"Extracting: {entry.name}")
+def unpack(archive, dir, filter_pattern='.*', incremental=False, compare=False, progress=None, **selection):
+    os.makedirs(dir, exist_ok=True)
+    try:
+        entries = select_entries(archive, filter_pattern, **selection)
+    except re.error:
+        print(f"FAILED: Invalid regex filter: {filter_pattern}")
+        return
+
+    if progress is None:
+        progress = console_progress()
+    progress.begin_stage('unpack', len(entries), sum(e.data.size for e in entries))
+    coder = Coder()
+    written = skipped = 0
+    written_bytes = skipped_bytes = 0
+    for entry in entries:
         path = os.path.join(dir, entry.name)
+
+        if incremental and os.path.isfile(path) and os.path.getsize(path) == entry.data.size:
+            if not compare or same_content(coder, archive, entry, path):
+                skipped += 1
+                skipped_bytes += entry.data.size
+                progress.entry(entry.name, entry.data.size, 'skip')
+                continue
+
         os.makedirs(os.path.dirname(path), exist_ok=True)
-        
-        with open(path, 'wb') as f:
+
+        # Incremental runs replace files atomically, so an interrupted run
+        # never leaves a half-written file that would later look unchanged
+        out_path = path + '.tmp' if incremental else path
+        with open(out_path, 'wb') as f:
             # Ensure stream is at correct position for each entry
             archive.stream.seek(entry.data.offset)
             coder.copy(archive.stream, f, entry.data)
+        if incremental:
+            os.replace(out_path, path)
+
+        written += 1
+        written_bytes += entry.data.size
+        progress.entry(entry.name, entry.data.size)
+
+    progress.end_stage()
+    if incremental:
+        print(f"Written: {written} files ({written_bytes} bytes), "
+              f"skipped: {skipped} files ({skipped_bytes} bytes)")
+
+BATCH_UNIT_BYTES = 8 << 20
+BATCH_UNIT_FILES = 256
+
+def batch_targets(patterns, out_root):
+    """(archive, output folder) pairs; folders mirror the archive paths below their common parent"""
+    archives = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) if glob.has_magic(pattern) else [pattern]
+        for match in matches:
+            location = os.path.abspath(match)
+            if location not in archives:
+                archives.append(location)
+    if not archives:
+        return []
+    root = os.path.commonpath([os.path.dirname(a) for a in archives])
+    folders = [os.path.splitext(os.path.relpath(a, root)) for a in archives]
+    clashes = Counter(os.path.normcase(base) for base, _ in folders)
+    # Game.rgss3a and Game.rgssad side by side go to Game_rgss3a and Game_rgssad
+    return [(a, os.path.join(out_root, base + ext.replace('.', '_') if clashes[os.path.normcase(base)] > 1 else base))
+            for a, (base, ext) in zip(archives, folders)]
+
+def unique_targets(targets):
+    """targets without repeated archives; two archives sharing a folder raise ValueError"""
+    archives = {}
+    folders = {}
+    for location, folder in targets:
+        key = os.path.normcase(os.path.abspath(location))
+        if key in archives:
+            continue
+        other = folders.setdefault(os.path.normcase(os.path.abspath(folder)), location)
+        if other != location:
+            raise ValueError(f"{other} and {location} would both be unpacked into {folder}")
+        archives[key] = (location, folder)
+    return list(archives.values())
+
+def extract_entries(location, out_dir, items):
+    """Decrypt (name, offset, magic, size) payloads of one archive into out_dir.
+
+    Returns (location, files, bytes, start time, end time).
+    """
+    started = time.time()
+    coder = Coder()
+    written = 0
+    with open(location, 'rb') as stream:
+        for name, offset, magic, size in items:
+            path = os.path.join(out_dir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                coder.copy(stream, f, EntryData(offset, magic, size))
+            written += size
+    return location, len(items), written, started, time.time()
+
+def batch_units(location, out_dir, entries):
+    """Work units of one archive: big entries alone, small ones grouped in payload order"""
+    units = []
+    items = []
+    total = 0
+    for entry in sorted(entries, key=lambda e: e.data.offset):
+        item = (entry.name, entry.data.offset, entry.data.magic, entry.data.size)
+        if entry.data.size >= BATCH_UNIT_BYTES:
+            units.append((entry.data.size, location, out_dir, [item]))
+            continue
+        items.append(item)
+        total += entry.data.size
+        if total >= BATCH_UNIT_BYTES or len(items) >= BATCH_UNIT_FILES:
+            units.append((total, location, out_dir, items))
+            items, total = [], 0
+    if items:
+        units.append((total, location, out_dir, items))
+    return units
+
+def format_rate(size, seconds):
+    return f"{size / (1 << 20):.1f} MiB in {seconds:.2f} s ({size / (1 << 20) / max(seconds, 1e-6):.1f} MiB/s)"
+
+def batch(targets, jobs=None):
+    """Unpack many archives on one process pool, largest work units first.
+
+    targets are (archive, output folder) pairs. Returns the number of failures.
+    """
+    started = time.time()
+    failures = 0
+    units = []
+    totals = {}
+    for location, out_dir in targets:
+        try:
+            with RGSSArchive.open(location) as archive:
+                entries = archive.entries
+        except Exception as e:
+            print(f"FAILED: unable to open {location}. {e}")
+            failures += 1
+            continue
+        totals[location] = [len(entries), sum(e.data.size for e in entries)]
+        units.extend(batch_units(location, out_dir, entries))
+
+    # Longest-processing-time first: the giant entries start right away and
+    # the small units fill the idle workers at the end
+    units.sort(key=lambda u: u[0], reverse=True)
+    all_bytes = sum(size for _, size in totals.values())
+    print(f"Scheduling {len(units)} work units from {len(totals)} archives ({all_bytes} bytes)")
+
+    jobs = jobs or os.cpu_count() or 1
+    progress = {location: [0, 0, None, None] for location in totals}  # files, bytes, first start, last end
+    done_bytes = 0
+
+    def finished(result):
+        nonlocal done_bytes
+        location, files, size, begin, end = result
+        state = progress[location]
+        state[0] += files
+        state[1] += size
+        state[2] = begin if state[2] is None else min(state[2], begin)
+        state[3] = end if state[3] is None else max(state[3], end)
+        done_bytes += size
+        if state[0] == totals[location][0]:
+            print(f"Done: {location}  {state[0]} files, {format_rate(state[1], state[3] - state[2])}")
+
+    if jobs == 1:
+        for _, location, out_dir, items in units:
+            try:
+                finished(extract_entries(location, out_dir, items))
+            except Exception as e:
+                print(f"FAILED: {location}. {e}")
+                failures += 1
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(extract_entries, location, out_dir, items): location
+                       for _, location, out_dir, items in units}
+            for future in as_completed(futures):
+                try:
+                    finished(future.result())
+                except Exception as e:
+                    print(f"FAILED: {futures[future]}. {e}")
+                    failures += 1
+
+    files = sum(state[0] for state in progress.values())
+    print(f"Total: {len(totals)} archives, {files} files, {format_rate(done_bytes, time.time() - started)}")
+    return failures
 
 def main():
     args = sys.argv
@@ -334,10 +1880,114 @@ def main():
         archive = RGSSArchive.open(args[2])
         list_archive(archive)
     elif cmd == "unpack":
-        archive = RGSSArchive.open(args[2])
-        filter_pattern = args[4] if len(args) > 4 else '.*'
-        unpack(archive, args[3], filter_pattern)
+        args, options = parse_options(args, SELECTION_OPTIONS + PROGRESS_OPTIONS)
+        try:
+            selection = selection_from_options(options)
+        except (OSError, ValueError) as e:
+            print(f"FAILED: Invalid selection. {e}")
+            return
+        with progress_from_options(options) as progress:
+            progress.begin_stage('index')
+            archive = RGSSArchive.open(args[2])
+            filter_pattern = args[4] if len(args) > 4 else '.*'
+            unpack(archive, args[3], filter_pattern,
+                   incremental=bool(options.get('incremental')),
+                   compare=bool(options.get('compare')), progress=progress, **selection)
+    elif cmd == "verify":
+        args, options = parse_options(args, ('jobs', 'output'))
+        jobs = int(options['jobs']) if options.get('jobs') else None
+        with RGSSArchive.open(args[2]) as archive:
+            if options.get('output'):
+                with open(options['output'], 'w', encoding='utf-8') as out:
+                    problems = verify(archive, args[2], out, jobs)
+            else:
+                problems = verify(archive, args[2], sys.stdout, jobs)
+        return 1 if problems else 0
+    elif cmd == "export":
+        args, options = parse_options(args, SELECTION_OPTIONS + PROGRESS_OPTIONS + ('format',))
+        try:
+            selection = selection_from_options(options)
+        except (OSError, ValueError) as e:
+            print(f"FAILED: Invalid selection. {e}")
+            return
+        with RGSSArchive.open(args[2]) as archive, progress_from_options(options, sys.stderr) as progress:
+            filter_pattern = args[4] if len(args) > 4 else '.*'
+            export(archive, args[3], options.get('format'), filter_pattern,
+                   deflate=bool(options.get('deflate')), progress=progress, **selection)
+    elif cmd == "convert":
+        args, options = parse_options(args, PROGRESS_OPTIONS)
+        version = None
+        if len(args) > 4:
+            try:
+                version = int(args[4])
+            except ValueError:
+                print(E_INVALIDVER)
+                return
+        with RGSSArchive.open(args[2]) as archive, progress_from_options(options) as progress:
+            convert(archive, args[3], version, progress)
+    elif cmd == "serve":
+        args, options = parse_options(args, ('socket', 'host', 'port', 'cache-mb'))
+        if len(args) < 3:
+            usage()
+            return
+        try:
+            port = int(options.get('port') or 8765)
+            cache_bytes = int(float(options['cache-mb']) * (1 << 20)) if options.get('cache-mb') else DEFAULT_CACHE_BYTES
+        except ValueError as e:
+            print(f"FAILED: Invalid option. {e}")
+            return
+        return serve(args[2:], options.get('socket'), options.get('host') or '127.0.0.1', port, cache_bytes)
+    elif cmd == "batch":
+        args, options = parse_options(args, ('out', 'jobs', 'from-list'))
+        try:
+            jobs = int(options['jobs']) if options.get('jobs') else None
+            if options.get('from-list'):
+                # One "archive<TAB>folder" per line
+                with open(options['from-list'], encoding='utf-8') as f:
+                    targets = [tuple(line.rstrip('\r\n').split('\t', 1)) for line in f if line.strip()]
+                if any(len(t) != 2 for t in targets):
+                    raise ValueError("each line needs an archive and a folder, separated by a tab")
+                targets = unique_targets(targets)
+            elif options.get('out') and len(args) > 2:
+                targets = batch_targets(args[2:], options['out'])
+            else:
+                usage()
+                return
+        except (OSError, ValueError) as e:
+            print(f"FAILED: Invalid batch list. {e}")
+            return
+        return 1 if batch(targets, jobs) else 0
+    elif cmd == "diff":
+        args, options = parse_options(args, ('patch', 'jobs'))
+        if len(args) < 4:
+            usage()
+            return
+        jobs = int(options['jobs']) if options.get('jobs') else None
+        with RGSSArchive.open(args[2]) as old, RGSSArchive.open(args[3]) as new:
+            added, removed, changed = diff_archives(old, args[2], new, args[3], jobs)
+            for mark, entries in (('A', added), ('D', removed), ('M', changed)):
+                for entry in entries:
+                    print(f"{mark}  {entry.name}")
+            delta = sum(e.data.size for e in added + changed)
+            print(f"{len(added)} added, {len(removed)} removed, {len(changed)} changed "
+                  f"({delta} bytes), {len(new.entries) - len(added) - len(changed)} unchanged", file=sys.stderr)
+            if options.get('patch'):
+                write_patch(old, args[2], new, options['patch'], added, changed, removed,
+                            Progress())
+        return 1 if added or removed or changed else 0
+    elif cmd == "apply":
+        args, options = parse_options(args, PROGRESS_OPTIONS)
+        if len(args) < 5:
+            usage()
+            return
+        if same_file(args[2], args[4]) or same_file(args[3], args[4]):
+            print("FAILED: the output must not overwrite an input archive.")
+            return 1
+        with RGSSArchive.open(args[2]) as old, RGSSArchive.open(args[3]) as patch, \
+                progress_from_options(options) as progress:
+            return 0 if apply_patch(old, args[2], patch, args[4], progress) else 1
     elif cmd == "pack":
+        args, options = parse_options(args, PROGRESS_OPTIONS + ('layout', 'trace', 'align'))
         version = 1
         if len(args) > 4:
             try:
@@ -345,9 +1995,21 @@ def main():
             except ValueError:
                 print(E_INVALIDVER)
                 return
-        pack(args[2], args[3], version)
+        layout = options.get('layout') or ('trace' if options.get('trace') else 'walk')
+        try:
+            trace = read_trace(options['trace']) if options.get('trace') else None
+            align = int(options['align']) if options.get('align') else 0
+            if layout not in PACK_LAYOUTS:
+                raise ValueError(f"unknown layout {layout!r}")
+            if layout == 'trace' and trace is None:
+                raise ValueError("the trace layout needs --trace FILE")
+        except (OSError, ValueError) as e:
+            print(f"FAILED: Invalid layout. {e}")
+            return
+        with progress_from_options(options) as progress:
+            pack(args[2], args[3], version, progress, layout, trace, align)
     else:
         usage()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
@@ -0,0 +1,317 @@
+"""Marshal 4.8 reader for RPG Maker VX Ace data files (*.rvdata2).
+
+A faster stand-in for rubymarshal.reader.load covering what the RPG::
+classes use: nil/true/false, fixnums, bignums, floats, symbols and links,
+ivars, strings, arrays, hashes, objects and user-defs (Table, Color, Tone).
+Objects are built from the same class registry as rubymarshal, so toMV's
+converters see the same classes. Strings carrying an encoding are decoded
+once into plain str (rubymarshal wraps them in RubyString), strings without
+one stay bytes.
+"""
+from rubymarshal.classes import RubyObject, Symbol, UserDef, UsrMarshal, registry as global_registry
+
+__all__ = ["Reader", "LinkError", "load", "loads", "iter_array"]
+
+_NIL, _TRUE, _FALSE = 0x30, 0x54, 0x46           # 0 T F
+_FIXNUM, _SYMBOL, _SYMLINK, _LINK = 0x69, 0x3A, 0x3B, 0x40   # i : ; @
+_IVAR, _STRING, _ARRAY, _HASH, _HASH_DEF = 0x49, 0x22, 0x5B, 0x7B, 0x7D   # I " [ { }
+_OBJECT, _USERDEF, _USRMARSHAL = 0x6F, 0x75, 0x55   # o u U
+_FLOAT, _BIGNUM, _CLASS, _MODULE = 0x66, 0x6C, 0x63, 0x6D   # f l c m
+
+class LinkError(ValueError):
+    """A link points to an object that was not loaded, dropped or skipped"""
+
+class Reader:
+    """Decode Marshal data from a bytes-like object.
+
+    skip is a set of ivar names (e.g. {"@note"}) whose values are stepped
+    over without being built; they are left out of the object's attributes.
+    A link pointing into a skipped value raises LinkError.
+
+    Objects of the classes named in spans (e.g. {"RPG::Event::Page"}) keep
+    the bytes they were read from in marshal_span. Within one stream, equal
+    spans decode to equal objects (links and symbol links index tables of
+    that stream), so they can key a cache of converted objects.
+    """
+    def __init__(self, data, registry=None, skip=(), spans=()):
+        self.data = memoryview(data)
+        self.pos = 0
+        self.symbols = []
+        self.objects = []
+        self.registry = registry or global_registry
+        self.skip_ivars = frozenset(skip)
+        self.span_classes = frozenset(spans)
+        self._classes = {}
+
+    def read_long(self):
+        data = self.data
+        pos = self.pos
+        c = data[pos]
+        pos += 1
+        if c == 0:
+            self.pos = pos
+            return 0
+        if c < 128:
+            if c > 4:
+                self.pos = pos
+                return c - 5
+            self.pos = pos + c
+            return int.from_bytes(data[pos:pos + c], 'little')
+        c -= 256
+        if c < -4:
+            self.pos = pos
+            return c + 5
+        c = -c
+        self.pos = pos + c
+        return int.from_bytes(data[pos:pos + c], 'little') - (1 << (8 * c))
+
+    def read_blob(self):
+        size = self.read_long()
+        pos = self.pos
+        self.pos = pos + size
+        return self.data[pos:pos + size]
+
+    def read_symbol(self):
+        token = self.data[self.pos]
+        self.pos += 1
+        if token == _SYMBOL:
+            name = str(self.read_blob(), 'utf-8')
+            self.symbols.append(name)
+            return name
+        if token == _SYMLINK:
+            return self.symbols[self.read_long()]
+        if token == _IVAR:
+            # Symbol with an encoding: :name followed by its ivars
+            name = self.read_symbol()
+            for _ in range(self.read_long()):
+                self.read_symbol()
+                self.read()
+            return name
+        raise ValueError(f"Expected a symbol, got token {token:#x} at {self.pos - 1}")
+
+    def python_class(self, name, default):
+        cls = self._classes.get(name)
+        if cls is None:
+            cls = self._classes[name] = self.registry.get(name, default)
+            if not issubclass(cls, default):
+                raise ValueError(f"Invalid class mapping for {name!r}: {cls!r} should be a subclass of {default!r}")
+        return cls
+
+    def read_string(self, ivar):
+        index = len(self.objects)
+        self.objects.append(None)
+        raw = self.read_blob()
+        if not ivar:
+            result = bytes(raw)
+        else:
+            encoding = "latin1"
+            for _ in range(self.read_long()):
+                key = self.read_symbol()
+                value = self.read()
+                if key == "E":
+                    encoding = "utf-8" if value is True else encoding
+                elif key == "encoding":
+                    encoding = bytes(value).decode() if not isinstance(value, str) else value
+            try:
+                result = str(raw, encoding)
+            except UnicodeDecodeError:
+                result = bytes(raw).decode("unicode-escape")
+        self.objects[index] = result
+        return result
+
+    def read(self):
+        data = self.data
+        token = data[self.pos]
+        self.pos += 1
+
+        if token == _NIL:
+            return None
+        if token == _FIXNUM:
+            return self.read_long()
+        if token == _IVAR:
+            if data[self.pos] == _STRING:
+                self.pos += 1
+                return self.read_string(True)
+            result = self.read()
+            attributes = {}
+            for _ in range(self.read_long()):
+                key = self.read_symbol()
+                attributes[key] = self.read()
+            if attributes and isinstance(result, RubyObject):
+                result.set_attributes(attributes)
+            return result
+        if token == _LINK:
+            index = self.read_long()
+            result = self.objects[index] if index < len(self.objects) else None
+            if result is None:
+                raise LinkError(f"Invalid link destination {index} (not loaded yet, dropped or skipped)")
+            return result
+        if token == _TRUE:
+            return True
+        if token == _FALSE:
+            return False
+        if token == _STRING:
+            return self.read_string(False)
+        if token == _ARRAY:
+            result = []
+            self.objects.append(result)
+            read = self.read
+            for _ in range(self.read_long()):
+                result.append(read())
+            return result
+        if token == _OBJECT:
+            start = self.pos - 1
+            name = self.read_symbol()
+            result = self.python_class(name, RubyObject)(name)
+            self.objects.append(result)
+            attributes = result.attributes
+            skip_ivars = self.skip_ivars
+            for _ in range(self.read_long()):
+                key = self.read_symbol()
+                if key in skip_ivars:
+                    self.skip()
+                else:
+                    attributes[key] = self.read()
+            if name in self.span_classes:
+                result.marshal_span = bytes(data[start:self.pos])
+            return result
+        if token == _SYMBOL or token == _SYMLINK:
+            self.pos -= 1
+            return Symbol(self.read_symbol())
+        if token == _HASH or token == _HASH_DEF:
+            result = {}
+            self.objects.append(result)
+            for _ in range(self.read_long()):
+                key = self.read()
+                if isinstance(key, list):
+                    key = _hashable(key)
+                result[key] = self.read()
+            if token == _HASH_DEF:
+                self.read()  # default value, dropped
+            return result
+        if token == _USERDEF:
+            index = len(self.objects)
+            self.objects.append(None)
+            name = self.read_symbol()
+            result = self.python_class(name, UserDef)(name)
+            result._load(bytes(self.read_blob()))
+            self.objects[index] = result
+            return result
+        if token == _FLOAT:
+            index = len(self.objects)
+            self.objects.append(None)
+            result = float(str(self.read_blob(), 'ascii').split("\0")[0])
+            self.objects[index] = result
+            return result
+        if token == _BIGNUM:
+            index = len(self.objects)
+            self.objects.append(None)
+            sign = data[self.pos]
+            self.pos += 1
+            size = 2 * self.read_long()
+            result = int.from_bytes(data[self.pos:self.pos + size], 'little')
+            self.pos += size
+            if sign == 0x2D:  # -
+                result = -result
+            self.objects[index] = result
+            return result
+        if token == _USRMARSHAL:
+            index = len(self.objects)
+            self.objects.append(None)
+            name = self.read_symbol()
+            result = self.python_class(name, UsrMarshal)(name)
+            result.marshal_load(self.read())
+            self.objects[index] = result
+            return result
+        if token == _CLASS or token == _MODULE:
+            index = len(self.objects)
+            self.objects.append(None)
+            name = str(self.read_blob(), 'utf-8')
+            result = self.registry[name] if name in self.registry else type(
+                name.rpartition(":")[2], (RubyObject,), {"ruby_class_name": name})
+            self.objects[index] = result
+            return result
+        raise ValueError(f"Unsupported Marshal token {token:#x} at {self.pos - 1}")
+
+    def skip(self):
+        """Step over one value, keeping the symbol and link tables in sync"""
+        data = self.data
+        token = data[self.pos]
+        self.pos += 1
+
+        if token in (_NIL, _TRUE, _FALSE):
+            return
+        if token == _FIXNUM or token == _LINK or token == _SYMLINK:
+            self.read_long()
+        elif token == _SYMBOL:
+            self.pos -= 1
+            self.read_symbol()
+        elif token == _IVAR:
+            self.skip()
+            for _ in range(self.read_long()):
+                self.read_symbol()
+                self.skip()
+        else:
+            self.objects.append(None)
+            if token in (_STRING, _FLOAT, _CLASS, _MODULE):
+                self.read_blob()
+            elif token == _ARRAY:
+                for _ in range(self.read_long()):
+                    self.skip()
+            elif token == _HASH or token == _HASH_DEF:
+                for _ in range(2 * self.read_long() + (token == _HASH_DEF)):
+                    self.skip()
+            elif token == _OBJECT:
+                self.read_symbol()
+                for _ in range(self.read_long()):
+                    self.read_symbol()
+                    self.skip()
+            elif token == _USERDEF:
+                self.read_symbol()
+                self.read_blob()
+            elif token == _USRMARSHAL:
+                self.read_symbol()
+                self.skip()
+            elif token == _BIGNUM:
+                self.pos += 1
+                self.pos += 2 * self.read_long()
+            else:
+                raise ValueError(f"Unsupported Marshal token {token:#x} at {self.pos - 1}")
+
+def _hashable(value):
+    if isinstance(value, list):
+        return tuple(_hashable(v) for v in value)
+    return value
+
+def _check_header(data):
+    if bytes(data[:2]) != b"\x04\x08":
+        raise ValueError("Expected Marshal 4.8 header")
+
+def loads(data, registry=None, skip=(), spans=()):
+    _check_header(data)
+    reader = Reader(data, registry, skip, spans)
+    reader.pos = 2
+    return reader.read()
+
+def load(fd, registry=None, skip=(), spans=()):
+    return loads(fd.read(), registry, skip, spans)
+
+def iter_array(data, registry=None, skip=(), spans=()):
+    """Yield the elements of a top-level Marshal array one at a time.
+
+    As with toMV.iter_rvdata_array, objects of an element are dropped from
+    the link table once the next element is requested, and a later link to
+    one of them raises LinkError.
+    """
+    _check_header(data)
+    reader = Reader(data, registry, skip, spans)
+    if reader.data[2] != _ARRAY:
+        raise ValueError("Expected a top-level array")
+    reader.pos = 3
+    reader.objects.append(None)  # the top-level array itself
+    objects = reader.objects
+    for _ in range(reader.read_long()):
+        start = len(objects)
+        yield reader.read()
+        for i in range(start, len(objects)):
+            objects[i] = None
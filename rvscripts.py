@@ -0,0 +1,253 @@
+"""Scripts.rvdata2 extraction and an identifier index of Ruby script usage.
+
+Scripts.rvdata2 is an array of [id, name, zlib-deflated source] sections.
+Sections are inflated in a process pool and can be written out as .rb files.
+The index maps identifiers (method and variable names, constants, $globals
+and the $global.method calls made on them) to where they appear: script
+sections and the script calls of events (codes 355/655, Conditional Branch
+111 and Control Variables 122), over any number of games, so "which games
+use $game_temp.reserve_common_event" is a lookup.
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import rpgmarshal
+
+IDENTIFIER_RE = re.compile(r"\$[A-Za-z_]\w*|@{0,2}[A-Za-z_]\w*[?!]?")
+QUALIFIED_RE = re.compile(r"\$[A-Za-z_]\w*\.[A-Za-z_]\w*[?!]?")
+# Strings are matched (and kept) so a "#" inside one does not start a comment
+COMMENT_RE = re.compile(r"""^=begin\b.*?^=end\b.*?$|("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|#.*?$""", re.M | re.S)
+
+RUBY_KEYWORDS = frozenset("""
+    BEGIN END alias and begin break case class def defined? do else elsif end
+    ensure false for if in module next nil not or redo rescue retry return
+    self super then true undef unless until when while yield
+""".split())
+
+EVENT_FILES = re.compile(r"(Map\d+|CommonEvents|Troops)\.rvdata2$", re.I)
+
+def text(value):
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value if isinstance(value, str) else ""
+
+def identifiers(source):
+    """Sorted identifiers of Ruby source, without comments and keywords.
+
+    Method calls on globals are also kept whole ("$game_party.gain_gold").
+    """
+    source = COMMENT_RE.sub(lambda m: m.group(1) or "", source)
+    found = set(IDENTIFIER_RE.findall(source)) | set(QUALIFIED_RE.findall(source))
+    return sorted(found - RUBY_KEYWORDS)
+
+class GameData:
+    """Data/ files of a game, from its folder, its Data folder or its archive"""
+    def __init__(self, path):
+        self.path = path
+        self.fs = None
+        if os.path.isfile(path):
+            from dec import ArchiveFS
+            # Every file is read once, so payload blocks are not cached
+            self.fs = ArchiveFS(path, cache_bytes=0)
+            self.folder = "Data"
+        elif os.path.isdir(os.path.join(path, "Data")):
+            self.folder = os.path.join(path, "Data")
+        else:
+            self.folder = path
+
+    def __reduce__(self):
+        return (GameData, (self.path,))
+
+    def listdir(self):
+        return (self.fs or os).listdir(self.folder)
+
+    def read(self, name):
+        if self.fs:
+            return self.fs.read(f"{self.folder}/{name}")
+        with open(os.path.join(self.folder, name), "rb") as f:
+            return f.read()
+
+@lru_cache(maxsize=1)
+def _game(path):
+    # Games are indexed one after another, so a worker keeps only the current one
+    return GameData(path)
+
+def load_sections(data):
+    """(name, deflated source) of each section of Scripts.rvdata2 data"""
+    sections = []
+    for section in rpgmarshal.loads(data):
+        code = section[2]
+        sections.append((text(section[1]), code.encode("latin1") if isinstance(code, str) else code))
+    return sections
+
+def inflate_section(section):
+    name, code = section
+    return name, zlib.decompress(code).decode("utf-8", "replace") if code else ""
+
+def index_section(section):
+    name, source = inflate_section(section)
+    return name, identifiers(source)
+
+def _command_scripts(commands, where):
+    # A 355 and the 655 lines after it are one script, located at the 355
+    script = None
+    for index, command in enumerate(commands or ()):
+        attributes = command.attributes
+        code = attributes.get("@code")
+        params = attributes.get("@parameters") or []
+        if code == 655 and script is not None:
+            script.append(text(params[0]))
+            continue
+        if script is not None:
+            yield start, "\n".join(script)
+            script = None
+        if code == 355:
+            script, start = [text(params[0])], f"{where} command {index}"
+        elif code == 111 and params and params[0] == 12:
+            yield f"{where} command {index}", text(params[1])
+        elif code == 122 and len(params) > 4 and params[3] == 4:
+            yield f"{where} command {index}", text(params[4])
+    if script is not None:
+        yield start, "\n".join(script)
+
+def event_scripts(name, data):
+    """(where, script) of every script call in a MapXXX, CommonEvents or Troops object"""
+    if name.lower().startswith("map"):
+        for event_id, event in sorted(data.attributes.get("@events", {}).items()):
+            for page, event_page in enumerate(event.attributes.get("@pages") or ()):
+                yield from _command_scripts(event_page.attributes.get("@list"), f"event {event_id} page {page}")
+    elif name.lower().startswith("commonevents"):
+        for event in data[1:]:
+            if event is not None:
+                yield from _command_scripts(event.attributes.get("@list"), f"common event {event.attributes.get('@id')}")
+    else:
+        for troop in data[1:]:
+            if troop is not None:
+                for page, troop_page in enumerate(troop.attributes.get("@pages") or ()):
+                    yield from _command_scripts(troop_page.attributes.get("@list"), f"troop {troop.attributes.get('@id')} page {page}")
+
+def index_event_file(path, name):
+    data = rpgmarshal.loads(_game(path).read(name))
+    return [(where, identifiers(script)) for where, script in event_scripts(name, data)]
+
+def find_scripts(game):
+    for name in game.listdir():
+        if name.lower() == "scripts.rvdata2":
+            return name
+    return None
+
+def extract(game, out_dir, workers=None):
+    """Write every non-empty section to out_dir/NNN_Name.rb, in script order"""
+    name = find_scripts(game)
+    if name is None:
+        print(f"FAILED: no Scripts.rvdata2 in {game.path}")
+        return 0
+    sections = load_sections(game.read(name))
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for index, (title, source) in enumerate(pool.map(inflate_section, sections, chunksize=16)):
+            if not source.strip():
+                continue
+            safe = re.sub(r'[\\/:*?"<>|\x00-\x1f]', "_", title).strip() or "untitled"
+            with open(os.path.join(out_dir, f"{index:03d}_{safe}.rb"), "w", encoding="utf-8", newline="") as out:
+                out.write(source)
+            written += 1
+    print(f"{written} scripts written to {out_dir}")
+    return written
+
+def build_index(paths, workers=None):
+    """Identifier index of the scripts and event script calls of several games.
+
+    locations holds [game, file, where] triples, identifiers maps each
+    identifier to the sorted indices of the locations using it.
+    """
+    locations = []
+    postings = {}
+
+    def add(game_index, file, where, names):
+        location = len(locations)
+        locations.append([game_index, file, where])
+        for name in names:
+            postings.setdefault(name, []).append(location)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for game_index, path in enumerate(paths):
+            game = GameData(path)
+            names = game.listdir()
+            scripts = find_scripts(game)
+            if scripts:
+                sections = load_sections(game.read(scripts))
+                for title, found in pool.map(index_section, sections, chunksize=16):
+                    if found:
+                        add(game_index, "Scripts", title, found)
+
+            event_files = sorted(n for n in names if EVENT_FILES.match(n))
+            results = pool.map(index_event_file, [path] * len(event_files), event_files)
+            for file, scripts_found in zip(event_files, results):
+                for where, found in scripts_found:
+                    add(game_index, os.path.splitext(file)[0], where, found)
+            print(f"Indexed {path}: {len(event_files)} event files", file=sys.stderr)
+
+    return {"format": 1, "games": list(paths), "locations": locations,
+            "identifiers": dict(sorted(postings.items()))}
+
+def query(index, name):
+    """[game, file, where] locations using the identifier name"""
+    games = index["games"]
+    locations = index["locations"]
+    return [[games[game], file, where]
+            for game, file, where in (locations[i] for i in index["identifiers"].get(name, ()))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract Scripts.rvdata2 and index Ruby script usage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    extract_parser = commands.add_parser("extract", help="Write every script section to a .rb file")
+    extract_parser.add_argument("game", help="Game folder, Data folder or Game.rgss3a")
+    extract_parser.add_argument("out_dir", nargs="?", default="Scripts")
+    extract_parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    index_parser = commands.add_parser("index", help="Index identifiers used by scripts and event script calls")
+    index_parser.add_argument("games", nargs="+", help="Game folders, Data folders or archives")
+    index_parser.add_argument("-o", "--output", default="scripts-index.json")
+    index_parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+
+    query_parser = commands.add_parser("query", help="Where identifiers are used")
+    query_parser.add_argument("names", nargs="+", help="Identifiers, e.g. $game_party or gain_gold")
+    query_parser.add_argument("-i", "--index", default="scripts-index.json")
+    query_parser.add_argument("--games", action="store_true", help="Only list the games")
+    args = parser.parse_args()
+
+    if args.command == "extract":
+        return 0 if extract(GameData(args.game), args.out_dir, args.workers) else 1
+
+    if args.command == "index":
+        index = build_index(args.games, args.workers)
+        with open(args.output, "w", encoding="utf-8") as out:
+            json.dump(index, out, ensure_ascii=False, separators=(",", ":"))
+        print(f"{len(index['identifiers'])} identifiers in {len(index['locations'])} locations written to {args.output}")
+        return 0
+
+    with open(args.index, encoding="utf-8") as f:
+        index = json.load(f)
+    found = False
+    for name in args.names:
+        locations = query(index, name)
+        found = found or bool(locations)
+        if args.games:
+            for game in dict.fromkeys(game for game, _, _ in locations):
+                print(f"{name}\t{game}")
+        else:
+            for game, file, where in locations:
+                print(f"{name}\t{game}\t{file}\t{where}")
+    return 0 if found else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
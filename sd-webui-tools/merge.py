@@ -1,4 +1,8 @@
+import argparse
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from PIL import Image
 
 # Configuration
@@ -6,51 +10,167 @@ rgb_input_dir = "facesGen_rgb"
 alpha_input_dir = "facesGen_alpha"
 output_dir = "facesOut"
 
+manifest_path = "tiles.json"
+
+# PNG settings for intermediate files: no zlib work, bigger files
+FAST_PNG = {"compress_level": 0, "optimize": False}
+
 def merge_images(rgb_img, alpha_img):
     # Convert alpha image to single channel
     alpha = alpha_img.convert("L")
-    
+
     # Create RGBA image
     rgba = Image.new("RGBA", rgb_img.size)
     rgba.paste(rgb_img, (0, 0))
-    
+
     # Apply alpha channel
     rgba.putalpha(alpha)
     return rgba
 
-os.makedirs(output_dir, exist_ok=True)
-
-# Get matching pairs
-rgb_files = {f.replace("_rgb", ""): f for f in os.listdir(rgb_input_dir) if f.endswith("_rgb.png")}
+def is_up_to_date(inputs, outputs):
+    # True when every output exists and is newer than every input
+    try:
+        oldest_out = min(os.path.getmtime(p) for p in outputs)
+    except OSError:
+        return False
+    return oldest_out >= max(os.path.getmtime(p) for p in inputs)
 
-for base_name, rgb_filename in rgb_files.items():
+def merge_file(base_name, rgb_filename, rgb_input_dir=rgb_input_dir,
+               alpha_input_dir=alpha_input_dir, output_dir=output_dir, fast=False, force=False):
     alpha_filename = f"{os.path.splitext(base_name)[0]}_alpha.png"
     alpha_path = os.path.join(alpha_input_dir, alpha_filename)
-    
+
     if not os.path.exists(alpha_path):
-        print(f"Missing alpha file for {base_name}")
-        continue
-        
+        return f"Missing alpha file for {base_name}"
+
+    rgb_path = os.path.join(rgb_input_dir, rgb_filename)
+    output_path = os.path.join(output_dir, f"{base_name}")
+    if not force and is_up_to_date([rgb_path, alpha_path], [output_path]):
+        return f"Up to date: {base_name}"
+
     try:
         # Load RGB image
-        rgb_path = os.path.join(rgb_input_dir, rgb_filename)
         with Image.open(rgb_path) as rgb_img:
-            
+
             # Load Alpha mask
             with Image.open(alpha_path) as alpha_img:
-                
+
                 # Verify dimensions match
                 if rgb_img.size != alpha_img.size:
-                    print(f"Size mismatch: {base_name}")
-                    continue
-                
+                    return f"Size mismatch: {base_name}"
+
                 # Merge images
                 merged = merge_images(rgb_img, alpha_img)
-                
+
                 # Save result
-                output_path = os.path.join(output_dir, f"{base_name}")
-                merged.save(output_path, "PNG")
-                print(f"Merged: {base_name}")
-                
+                merged.save(output_path, "PNG", **(FAST_PNG if fast else {}))
+                return f"Merged: {base_name}"
+
     except Exception as e:
-        print(f"Error processing {base_name}: {str(e)}")
+        return f"Error processing {base_name}: {str(e)}"
+
+def merge_sheet(filename, entry, rgb_input_dir=rgb_input_dir, alpha_input_dir=alpha_input_dir,
+                output_dir=output_dir, fast=False, force=False, scale=None):
+    # Rebuild one sheet from its upscaled cells (see split.py --tiles).
+    # scale is the (x, y) upscale factor, used for sheets without any cell.
+    output_path = os.path.join(output_dir, filename)
+    digests = sorted({digest for _, _, digest in entry["cells"]})
+    inputs = [os.path.join(d, f"{digest}{suffix}")
+              for digest in digests
+              for d, suffix in ((rgb_input_dir, "_rgb.png"), (alpha_input_dir, "_alpha.png"))]
+
+    missing = [p for p in inputs if not os.path.exists(p)]
+    if missing:
+        return f"Missing cell {os.path.basename(missing[0])} for {filename}"
+    if not force and inputs and is_up_to_date(inputs, [output_path]):
+        return f"Up to date: {filename}"
+
+    try:
+        cells = {}
+        for digest in digests:
+            with Image.open(os.path.join(rgb_input_dir, f"{digest}_rgb.png")) as rgb_img, \
+                 Image.open(os.path.join(alpha_input_dir, f"{digest}_alpha.png")) as alpha_img:
+                if rgb_img.size != alpha_img.size:
+                    return f"Size mismatch: {digest} in {filename}"
+                cells[digest] = merge_images(rgb_img, alpha_img)
+
+        cell_w, cell_h = entry["cell"]
+        cols = entry["size"][0] // cell_w
+        rows = entry["size"][1] // cell_h
+        if cells:
+            # Every cell went through the same upscale factor
+            up_w, up_h = next(iter(cells.values())).size
+        elif scale:
+            up_w, up_h = round(cell_w * scale[0]), round(cell_h * scale[1])
+        else:
+            return f"Error processing {filename}: no cells, and no upscale factor to size the empty sheet"
+
+        sheet = Image.new("RGBA", (cols * up_w, rows * up_h), (0, 0, 0, 0))
+        for col, row, digest in entry["cells"]:
+            sheet.paste(cells[digest], (col * up_w, row * up_h))
+
+        sheet.save(output_path, "PNG", **(FAST_PNG if fast else {}))
+        return f"Merged: {filename} ({len(entry['cells'])} cells)"
+
+    except Exception as e:
+        return f"Error processing {filename}: {str(e)}"
+
+def upscale_factor(sheets, rgb_input_dir=rgb_input_dir):
+    # (x, y) factor between a split cell and its upscaled image, from the first one found
+    for entry in sheets.values():
+        for _, _, digest in entry["cells"]:
+            path = os.path.join(rgb_input_dir, f"{digest}_rgb.png")
+            if os.path.exists(path):
+                with Image.open(path) as img:
+                    return img.width / entry["cell"][0], img.height / entry["cell"][1]
+    return None
+
+def merge_sheets(rgb_input_dir=rgb_input_dir, alpha_input_dir=alpha_input_dir, output_dir=output_dir,
+                 manifest=manifest_path, workers=None, fast=False, force=False):
+    os.makedirs(output_dir, exist_ok=True)
+
+    with open(manifest, "r", encoding="utf-8") as f:
+        sheets = json.load(f)["sheets"]
+    job = partial(merge_sheet, rgb_input_dir=rgb_input_dir, alpha_input_dir=alpha_input_dir,
+                  output_dir=output_dir, fast=fast, force=force,
+                  scale=upscale_factor(sheets, rgb_input_dir))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for message in pool.map(job, sheets.keys(), sheets.values(), chunksize=4):
+            print(message)
+
+def merge_dir(rgb_input_dir=rgb_input_dir, alpha_input_dir=alpha_input_dir,
+              output_dir=output_dir, workers=None, fast=False, force=False):
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Get matching pairs
+    rgb_files = {f.replace("_rgb", ""): f for f in os.listdir(rgb_input_dir) if f.endswith("_rgb.png")}
+    job = partial(merge_file, rgb_input_dir=rgb_input_dir, alpha_input_dir=alpha_input_dir,
+                  output_dir=output_dir, fast=fast, force=force)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for message in pool.map(job, rgb_files.keys(), rgb_files.values(), chunksize=16):
+            print(message)
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge upscaled RGB and alpha mask images back into RGBA PNGs")
+    parser.add_argument("rgb_input_dir", nargs="?", default=rgb_input_dir)
+    parser.add_argument("alpha_input_dir", nargs="?", default=alpha_input_dir)
+    parser.add_argument("output_dir", nargs="?", default=output_dir)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--fast", action="store_true", help="Save PNGs uncompressed")
+    parser.add_argument("--force", action="store_true", help="Merge images even if outputs are up to date")
+    parser.add_argument("--tiles", action="store_true", help="Reassemble sheets cut by split.py --tiles")
+    parser.add_argument("--manifest", default=manifest_path, help="Cell layout file written by split.py --tiles")
+    args = parser.parse_args()
+
+    if args.tiles:
+        merge_sheets(args.rgb_input_dir, args.alpha_input_dir, args.output_dir, manifest=args.manifest,
+                     workers=args.workers, fast=args.fast, force=args.force)
+        return
+
+    merge_dir(args.rgb_input_dir, args.alpha_input_dir, args.output_dir,
+              workers=args.workers, fast=args.fast, force=args.force)
+
+if __name__ == "__main__":
+    main()
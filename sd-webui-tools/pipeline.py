@@ -0,0 +1,106 @@
+import argparse
+import base64
+import json
+import os
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from PIL import Image
+
+from split import process_image, is_up_to_date, FAST_PNG
+
+# Configuration
+input_dir = "faces"
+output_dir = "facesOut"
+
+class ResizeUpscaler:
+    # Offline stand-in for the WebUI step (plain resampling)
+    def __init__(self, scale=1.5, resample=Image.LANCZOS):
+        self.scale = scale
+        self.resample = resample
+
+    def __call__(self, img):
+        size = (round(img.width * self.scale), round(img.height * self.scale))
+        return img.resize(size, self.resample)
+
+class WebUIUpscaler:
+    # Upscale through a running Stable Diffusion WebUI (--api) "Extras" endpoint
+    def __init__(self, url="http://127.0.0.1:7860", upscaler="R-ESRGAN 4x+ Anime6B", scale=1.5):
+        self.url = url.rstrip("/") + "/sdapi/v1/extra-single-image"
+        self.upscaler = upscaler
+        self.scale = scale
+
+    def __call__(self, img):
+        buf = BytesIO()
+        img.save(buf, "PNG", **FAST_PNG)
+        payload = json.dumps({
+            "image": base64.b64encode(buf.getvalue()).decode("ascii"),
+            "upscaling_resize": self.scale,
+            "upscaler_1": self.upscaler,
+        }).encode("utf-8")
+        request = urllib.request.Request(self.url, payload, {"Content-Type": "application/json"})
+        with urllib.request.urlopen(request) as response:
+            result = json.load(response)
+        return Image.open(BytesIO(base64.b64decode(result["image"])))
+
+def upscale_image(img, upscaler):
+    # Split, upscale both channels and merge without touching the disk
+    rgb_img, alpha_img = process_image(img, None)
+    rgb_up = upscaler(rgb_img).convert("RGB")
+    alpha_up = upscaler(alpha_img).convert("L")
+
+    if rgb_up.size != alpha_up.size:
+        raise ValueError(f"Upscaled size mismatch: {rgb_up.size} != {alpha_up.size}")
+
+    # Attach the alpha band in one step
+    return Image.merge("RGBA", (*rgb_up.split(), alpha_up))
+
+def upscale_file(filename, upscaler, input_dir=input_dir, output_dir=output_dir, fast=False, force=False):
+    input_path = os.path.join(input_dir, filename)
+    output_path = os.path.join(output_dir, filename)
+
+    if not force and is_up_to_date([input_path], [output_path]):
+        return f"Up to date: {filename}"
+
+    try:
+        with Image.open(input_path) as img:
+            upscale_image(img, upscaler).save(output_path, "PNG", **(FAST_PNG if fast else {}))
+            return f"Upscaled: {filename}"
+
+    except Exception as e:
+        return f"Error processing {filename}: {str(e)}"
+
+def upscale_dir(upscaler, input_dir=input_dir, output_dir=output_dir, workers=None, fast=False, force=False):
+    os.makedirs(output_dir, exist_ok=True)
+
+    filenames = [f for f in os.listdir(input_dir) if f.lower().endswith(".png")]
+    job = partial(upscale_file, upscaler=upscaler, input_dir=input_dir,
+                  output_dir=output_dir, fast=fast, force=force)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for message in pool.map(job, filenames, chunksize=16):
+            print(message)
+
+def main():
+    parser = argparse.ArgumentParser(description="Split, upscale and merge PNGs in memory")
+    parser.add_argument("input_dir", nargs="?", default=input_dir)
+    parser.add_argument("output_dir", nargs="?", default=output_dir)
+    parser.add_argument("-s", "--scale", type=float, default=1.5)
+    parser.add_argument("--webui", metavar="URL", help="Stable Diffusion WebUI address (default: local resize)")
+    parser.add_argument("--upscaler", default="R-ESRGAN 4x+ Anime6B", help="WebUI upscaler name")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--fast", action="store_true", help="Save PNGs uncompressed")
+    parser.add_argument("--force", action="store_true", help="Process images even if outputs are up to date")
+    args = parser.parse_args()
+
+    if args.webui:
+        upscaler = WebUIUpscaler(args.webui, args.upscaler, args.scale)
+    else:
+        upscaler = ResizeUpscaler(args.scale)
+
+    upscale_dir(upscaler, args.input_dir, args.output_dir,
+                workers=args.workers, fast=args.fast, force=args.force)
+
+if __name__ == "__main__":
+    main()
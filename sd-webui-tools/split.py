@@ -1,4 +1,9 @@
+import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from PIL import Image
 
 # Configuration
@@ -7,10 +12,17 @@ input_dir = "faces"
 rgb_output_dir = "facesIn_rgb"
 alpha_output_dir = "facesIn_alpha"
 
+manifest_path = "tiles.json"
+
+# PNG settings for intermediate files: no zlib work, bigger files
+FAST_PNG = {"compress_level": 0, "optimize": False}
+
+FACE_SIZE = 96
+
 def process_image(img, base_filename):
     # Split into RGB and Alpha
     rgb_img = img.convert("RGB")
-    
+
     # Create alpha mask (white = opaque, black = transparent)
     if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
         alpha = img.split()[-1]  # Get alpha channel
@@ -18,33 +30,174 @@ def process_image(img, base_filename):
     else:
         # No alpha channel - create fully opaque mask
         alpha_mask = Image.new("L", img.size, 255)
-    
+
     # Convert alpha mask to RGB (white = 255, black = 0)
     alpha_rgb = alpha_mask.convert("RGB")
-    
+
     return rgb_img, alpha_rgb
 
-os.makedirs(rgb_output_dir, exist_ok=True)
-os.makedirs(alpha_output_dir, exist_ok=True)
-
-for filename in os.listdir(input_dir):
-    if filename.lower().endswith(".png"):
-        input_path = os.path.join(input_dir, filename)
-        base_name = os.path.splitext(filename)[0]
-        
-        try:
-            with Image.open(input_path) as img:
-                rgb_img, alpha_img = process_image(img, base_name)
-                
-                # Save RGB version
-                rgb_path = os.path.join(rgb_output_dir, f"{base_name}_rgb.png")
-                rgb_img.save(rgb_path, "PNG")
-                
-                # Save Alpha mask version
-                alpha_path = os.path.join(alpha_output_dir, f"{base_name}_alpha.png")
-                alpha_img.save(alpha_path, "PNG")
-                
-                print(f"Processed: {filename}")
-                
-        except Exception as e:
-            print(f"Error processing {filename}: {str(e)}")
\ No newline at end of file
+def is_up_to_date(inputs, outputs, fs=None):
+    # True when every output exists and is newer than every input
+    try:
+        oldest_out = min(os.path.getmtime(p) for p in outputs)
+    except OSError:
+        return False
+    getmtime = fs.getmtime if fs else os.path.getmtime
+    return oldest_out >= max(getmtime(p) for p in inputs)
+
+def open_input(path, fs=None):
+    # Input images come from disk, or from an archive through dec.ArchiveFS
+    return Image.open(fs.open(path) if fs else path)
+
+def split_file(filename, input_dir=input_dir, rgb_output_dir=rgb_output_dir,
+               alpha_output_dir=alpha_output_dir, fast=False, force=False, fs=None):
+    input_path = os.path.join(input_dir, filename)
+    base_name = os.path.splitext(filename)[0]
+    rgb_path = os.path.join(rgb_output_dir, f"{base_name}_rgb.png")
+    alpha_path = os.path.join(alpha_output_dir, f"{base_name}_alpha.png")
+
+    if not force and is_up_to_date([input_path], [rgb_path, alpha_path], fs):
+        return f"Up to date: {filename}"
+
+    save_options = FAST_PNG if fast else {}
+    try:
+        with open_input(input_path, fs) as img:
+            rgb_img, alpha_img = process_image(img, base_name)
+
+            # Save RGB version
+            rgb_img.save(rgb_path, "PNG", **save_options)
+
+            # Save Alpha mask version
+            alpha_img.save(alpha_path, "PNG", **save_options)
+
+            return f"Processed: {filename}"
+
+    except Exception as e:
+        return f"Error processing {filename}: {str(e)}"
+
+def sheet_grid(filename, size, kind):
+    # (cell_width, cell_height) of a VX Ace Faces/ or Characters/ sheet
+    width, height = size
+    if kind == "faces":
+        cell = (FACE_SIZE, FACE_SIZE)
+    elif kind == "characters":
+        # 3x4 frames per character, 4x2 characters unless the name has a "$"
+        name = os.path.basename(filename).lstrip("!")
+        cols, rows = (3, 4) if name.startswith("$") else (12, 8)
+        cell = (width // cols, height // rows)
+    else:
+        raise ValueError(f"Unknown sheet kind: {kind}")
+
+    if not cell[0] or not cell[1] or width % cell[0] or height % cell[1]:
+        return size  # Not a regular sheet, keep it whole
+    return cell
+
+def split_sheet(filename, kind, input_dir=input_dir, rgb_output_dir=rgb_output_dir,
+                alpha_output_dir=alpha_output_dir, fast=False, force=False, fs=None):
+    # Cut a sheet into cells, writing each distinct non-empty cell once.
+    # Returns (message, manifest entry), cells are named by content hash.
+    # The entry is None when the sheet could not be split.
+    input_path = os.path.join(input_dir, filename)
+    save_options = FAST_PNG if fast else {}
+
+    try:
+        with open_input(input_path, fs) as img:
+            sheet = img.convert("RGBA")
+        cell_w, cell_h = sheet_grid(filename, sheet.size, kind)
+
+        cells = []
+        for row in range(sheet.height // cell_h):
+            for col in range(sheet.width // cell_w):
+                cell = sheet.crop((col * cell_w, row * cell_h, (col + 1) * cell_w, (row + 1) * cell_h))
+                if cell.getchannel("A").getextrema()[1] == 0:
+                    continue  # Fully transparent
+
+                digest = hashlib.sha1(cell.tobytes()).hexdigest()
+                cells.append([col, row, digest])
+
+                rgb_path = os.path.join(rgb_output_dir, f"{digest}_rgb.png")
+                alpha_path = os.path.join(alpha_output_dir, f"{digest}_alpha.png")
+                if not force and os.path.exists(rgb_path) and os.path.exists(alpha_path):
+                    continue  # Same cell already written (this run or a previous one)
+
+                rgb_img, alpha_img = process_image(cell, digest)
+                for out_img, out_path in ((rgb_img, rgb_path), (alpha_img, alpha_path)):
+                    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+                    out_img.save(tmp_path, "PNG", **save_options)
+                    os.replace(tmp_path, out_path)
+
+    except Exception as e:
+        return f"Error processing {filename}: {str(e)}", None
+
+    entry = {"size": list(sheet.size), "cell": [cell_w, cell_h], "cells": cells}
+    return f"Processed: {filename} ({len(cells)} cells)", entry
+
+def split_sheets(kind, input_dir=input_dir, rgb_output_dir=rgb_output_dir,
+                 alpha_output_dir=alpha_output_dir, manifest=manifest_path, workers=None, fast=False,
+                 force=False, fs=None):
+    os.makedirs(rgb_output_dir, exist_ok=True)
+    os.makedirs(alpha_output_dir, exist_ok=True)
+
+    filenames = [f for f in (fs or os).listdir(input_dir) if f.lower().endswith(".png")]
+    job = partial(split_sheet, kind=kind, input_dir=input_dir, rgb_output_dir=rgb_output_dir,
+                  alpha_output_dir=alpha_output_dir, fast=fast, force=force, fs=fs)
+
+    sheets = {}
+    total = 0
+    unique = set()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for filename, (message, entry) in zip(filenames, pool.map(job, filenames, chunksize=4)):
+            print(message)
+            if entry is None:
+                continue  # Left out of the manifest
+            sheets[filename] = entry
+            cell_w, cell_h = entry["cell"]
+            total += (entry["size"][0] // cell_w) * (entry["size"][1] // cell_h)
+            unique.update(digest for _, _, digest in entry["cells"])
+
+    with open(manifest, "w", encoding="utf-8") as out:
+        json.dump({"kind": kind, "sheets": sheets}, out, indent=1)
+
+    print(f"{len(unique)} unique cells to upscale out of {total}")
+
+def split_dir(input_dir=input_dir, rgb_output_dir=rgb_output_dir,
+              alpha_output_dir=alpha_output_dir, workers=None, fast=False, force=False, fs=None):
+    os.makedirs(rgb_output_dir, exist_ok=True)
+    os.makedirs(alpha_output_dir, exist_ok=True)
+
+    filenames = [f for f in (fs or os).listdir(input_dir) if f.lower().endswith(".png")]
+    job = partial(split_file, input_dir=input_dir, rgb_output_dir=rgb_output_dir,
+                  alpha_output_dir=alpha_output_dir, fast=fast, force=force, fs=fs)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for message in pool.map(job, filenames, chunksize=16):
+            print(message)
+
+def main():
+    parser = argparse.ArgumentParser(description="Split PNGs into RGB and alpha mask images for upscaling")
+    parser.add_argument("input_dir", nargs="?", default=input_dir)
+    parser.add_argument("rgb_output_dir", nargs="?", default=rgb_output_dir)
+    parser.add_argument("alpha_output_dir", nargs="?", default=alpha_output_dir)
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--fast", action="store_true", help="Save PNGs uncompressed (intermediate files)")
+    parser.add_argument("--force", action="store_true", help="Process images even if outputs are up to date")
+    parser.add_argument("--tiles", choices=("faces", "characters"), help="Cut sheets into cells, skipping empty and duplicate ones")
+    parser.add_argument("--manifest", default=manifest_path, help="Cell layout file for merge.py --tiles")
+    parser.add_argument("--archive", help="Read input_dir inside this Game.rgss3a (needs dec.py on the path)")
+    args = parser.parse_args()
+
+    fs = None
+    if args.archive:
+        from dec import ArchiveFS
+        fs = ArchiveFS(args.archive)
+
+    if args.tiles:
+        split_sheets(args.tiles, args.input_dir, args.rgb_output_dir, args.alpha_output_dir,
+                     manifest=args.manifest, workers=args.workers, fast=args.fast, force=args.force, fs=fs)
+        return
+
+    split_dir(args.input_dir, args.rgb_output_dir, args.alpha_output_dir,
+              workers=args.workers, fast=args.fast, force=args.force, fs=fs)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
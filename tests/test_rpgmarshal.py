@@ -0,0 +1,124 @@
+"""rpgmarshal against rubymarshal.reader on data written by rubymarshal.writer.
+
+Both readers must convert to the same JSON, compared value by value with
+their exact types (toMV._json_tree), as toMV.py --check-marshal does on
+real game data.
+"""
+import io
+import os
+import struct
+import sys
+
+import pytest
+from rubymarshal.classes import RubyObject, RubyString, UserDef
+from rubymarshal.writer import writes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import rpgmarshal
+import toMV
+
+
+def obj(cls, **attributes):
+    return RubyObject(cls, {"@" + name: value for name, value in attributes.items()})
+
+
+def table(values, x, y=1, z=1):
+    dim = 1 if y == 1 and z == 1 else (2 if z == 1 else 3)
+    data = UserDef("Table")
+    data._private_data = struct.pack("<5I", dim, x, y, z, len(values)) + struct.pack(f"<{len(values)}h", *values)
+    return data
+
+
+def command(code, parameters, indent=0):
+    return obj("RPG::EventCommand", code=code, indent=indent, parameters=parameters)
+
+
+def converted(data, reader):
+    return toMV._json_tree(toMV._tojson_any(toMV.load_rvdata(io.BytesIO(data), reader)))
+
+
+def assert_same(data):
+    results = [converted(data, reader) for reader in toMV.MARSHAL_READERS]
+    assert results[0] == results[1]
+
+
+# rubymarshal.writer does not number plain str, bytes and float values in
+# its link table as Ruby does, so links are written before any of them.
+
+def test_plain_values():
+    shared = RubyString("shared")
+    values = [shared, shared, [shared], None, True, False, 0, -1, 123, 2 ** 40, -2 ** 40,
+              1.5, -0.0, 1e100, "text", "日本語", b"raw", {1: "a", 2: [2]}]
+    data = writes(values)
+    results = [toMV._json_tree(toMV.convert_ruby_strings(toMV.load_rvdata(io.BytesIO(data), reader)))
+               for reader in toMV.MARSHAL_READERS]
+    assert results[0] == results[1]
+    loaded = rpgmarshal.loads(data)
+    assert loaded[0] is loaded[1] is loaded[2][0]  # linked, not copied
+
+
+def test_linked_strings_and_floats():
+    line = RubyString("Hello there")
+    pages = [obj("RPG::Troop::Page", condition=obj("RPG::Troop::Page::Condition", turn_valid=True, turn_a=1), span=0,
+                 list=[command(401, [line]), command(401, [line]), command(0, [])])]
+    members = [obj("RPG::Troop::Member", enemy_id=1, x=100.5, y=-0.0, hidden=False),
+               obj("RPG::Troop::Member", enemy_id=2, x=1e-3, y=288.0, hidden=True)]
+    troop = obj("RPG::Troop", id=1, pages=pages, members=members, name="Slime*2")
+    assert_same(writes([None, troop]))
+
+
+def test_table_user_defs():
+    tileset = obj("RPG::Tileset", id=1, name="Field", mode=1, note="",
+                  flags=table([(i * 37) % 0x7FFF - 0x10 for i in range(8192)], 8192),
+                  tileset_names=["A1", "A2", "", "", "", "B", "", "", ""])
+    assert_same(writes([None, tileset]))
+
+
+def test_common_events():
+    events = [None] + [obj("RPG::CommonEvent", id=i, name=f"CE{i}", trigger=0, switch_id=1,
+                           list=[command(401, [f"Line {i}"]), command(108, ["a comment"]), command(0, [])])
+                       for i in (1, 2, 3)]
+    data = writes(events)
+    assert_same(data)
+    for reader in toMV.MARSHAL_READERS:
+        streamed = list(toMV.iter_rvdata_array(io.BytesIO(data), reader))
+        assert [e and e.tojson() for e in streamed] == [e and e.tojson() for e in toMV.load_rvdata(io.BytesIO(data), reader)]
+
+
+@pytest.mark.parametrize("reader", toMV.MARSHAL_READERS)
+def test_iter_array_refuses_links_into_dropped_records(reader):
+    shared = RubyString("shared")
+    data = writes([None, obj("RPG::CommonEvent", id=1, name=shared), obj("RPG::CommonEvent", id=2, name=shared)])
+    records = toMV.iter_rvdata_array(io.BytesIO(data), reader)
+    assert next(records) is None
+    assert next(records).attributes["@id"] == 1
+    with pytest.raises(rpgmarshal.LinkError):
+        next(records)
+
+
+def test_skip():
+    data = writes([obj("RPG::Item", id=1, name="Potion", note="long note"), obj("RPG::Item", id=2, name="Ether", note="")])
+    items = rpgmarshal.loads(data, skip={"@note"})
+    assert [sorted(item.attributes) for item in items] == [["@id", "@name"], ["@id", "@name"]]
+    assert [item.attributes["@name"] for item in items] == ["Potion", "Ether"]
+
+
+def test_skip_refuses_links_into_skipped_values():
+    note = RubyString("shared note")
+    data = writes([obj("RPG::Item", id=1, note=note), obj("RPG::Item", id=2, name=note)])
+    assert rpgmarshal.loads(data)[1].attributes["@name"] == "shared note"
+    with pytest.raises(rpgmarshal.LinkError):
+        rpgmarshal.loads(data, skip={"@note"})
+
+
+def test_spans():
+    def route(wait):
+        return obj("RPG::MoveRoute", repeat=True, skippable=False, wait=wait,
+                   list=[obj("RPG::MoveCommand", code=0, parameters=[])])
+    # The first route defines the symbols, the others link to them
+    data = writes([route(False), route(False), route(False), route(True)])
+    routes = rpgmarshal.loads(data, spans={"RPG::MoveRoute"})
+    assert routes[1].marshal_span == routes[2].marshal_span != routes[3].marshal_span
+    assert not hasattr(routes[0].attributes["@list"][0], "marshal_span")
+    assert not hasattr(rpgmarshal.loads(data)[0], "marshal_span")
@@ -0,0 +1,151 @@
+"""Inverted index of event dialogue: Show Text (401), choices (102) and comments.
+
+toMV.py --text-index fills it from the converted maps, common events and
+troops, then this script answers queries from the saved index without
+opening any MapXXX.json again:
+
+    python textindex.py "potion" -i OUT/dialogue-index.json
+
+Latin words are indexed whole, other scripts (kana, kanji, hangul...) as
+character bigrams since they have no spaces. A query is tokenized the same
+way, its tokens narrow the lines down, then the query is matched as a
+case-insensitive substring of each remaining line. So latin words of the
+query have to be whole words ("potion", not "poti"), other text can be any
+part of a line.
+"""
+import argparse
+import json
+import re
+import sys
+import time
+
+TEXT_CODES = {401: "text", 102: "choice", 108: "comment", 408: "comment"}
+
+TOKEN_RE = re.compile(r"[0-9a-z]+|[^\W0-9a-z_]+")
+
+def tokens(text):
+    """Lowercase words, and bigrams of runs without spaces (a lone char stays whole)"""
+    found = set()
+    for run in TOKEN_RE.findall(text.lower()):
+        if run.isascii() or len(run) == 1:
+            found.add(run)
+        else:
+            found.update(run[i:i + 2] for i in range(len(run) - 1))
+    return found
+
+def query_tokens(query):
+    # A lone non-latin char may sit inside a longer run, it cannot narrow anything down
+    return {t for t in tokens(query) if t.isascii() or len(t) > 1}
+
+class TextIndex:
+    """Lines of dialogue with their location, and token -> line postings.
+
+    A line is [file, event id, page, command index, code, text]; page is
+    None for common events, which have a single list.
+    """
+    def __init__(self, lines=None, postings=None):
+        self.lines = lines or []
+        self.postings = postings or {}
+
+    def add(self, file, event, page, index, code, text):
+        if not isinstance(text, str) or not text:
+            return
+        line = len(self.lines)
+        self.lines.append([file, event, page, index, code, text])
+        for token in tokens(text):
+            self.postings.setdefault(token, []).append(line)
+
+    def truncate(self, length):
+        """Drop the lines added after the first length ones"""
+        for line in self.lines[length:]:
+            for token in tokens(line[5]):
+                found = self.postings[token]
+                while found and found[-1] >= length:
+                    found.pop()
+                if not found:
+                    del self.postings[token]
+        del self.lines[length:]
+
+    def add_list(self, file, event, page, commands):
+        """Index the text commands of one converted (MV JSON) command list"""
+        for index, command in enumerate(commands or ()):
+            code = command["code"]
+            if code not in TEXT_CODES or not command["parameters"]:
+                continue
+            text = command["parameters"][0]
+            for line in (text if code == 102 else (text,)):
+                self.add(file, event, page, index, code, line)
+
+    def add_map(self, file, map_json):
+        for event in map_json.get("events") or ():
+            if event:
+                for page, event_page in enumerate(event.get("pages") or ()):
+                    self.add_list(file, event["id"], page, event_page.get("list"))
+
+    def add_common_event(self, file, common_event):
+        self.add_list(file, common_event["id"], None, common_event.get("list"))
+
+    def add_troop(self, file, troop):
+        for page, troop_page in enumerate(troop.get("pages") or ()):
+            self.add_list(file, troop["id"], page, troop_page.get("list"))
+
+    def search(self, query, kinds=None):
+        """Lines containing query (case-insensitive), optionally only of some kinds"""
+        wanted = query_tokens(query)
+        if wanted:
+            candidates = None
+            for token in sorted(wanted, key=lambda t: len(self.postings.get(t, ()))):
+                found = self.postings.get(token)
+                if not found:
+                    return []
+                candidates = set(found) if candidates is None else candidates.intersection(found)
+            candidates = sorted(candidates)
+        else:
+            candidates = range(len(self.lines))
+
+        needle = query.lower()
+        results = []
+        for i in candidates:
+            line = self.lines[i]
+            if (kinds is None or TEXT_CODES[line[4]] in kinds) and needle in line[5].lower():
+                results.append(line)
+        return results
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as out:
+            json.dump({"format": 1, "lines": self.lines, "tokens": self.postings},
+                      out, ensure_ascii=False, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["lines"], data["tokens"])
+
+def location(line):
+    file, event, page, index = line[:4]
+    page = "" if page is None else f" page {page}"
+    kind = "troop" if file.startswith("Troops") else "event"
+    return f"{file} {kind} {event}{page} command {index}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Search event dialogue indexed by toMV.py --text-index")
+    parser.add_argument("query", nargs="+", help="Text to find (words are joined with spaces)")
+    parser.add_argument("-i", "--index", default="OUT/dialogue-index.json")
+    parser.add_argument("--kind", action="append", choices=sorted(set(TEXT_CODES.values())),
+                        help="Only these kinds of lines (repeatable)")
+    parser.add_argument("-n", "--limit", type=int, default=0, help="Print at most N lines")
+    args = parser.parse_args()
+
+    index = TextIndex.load(args.index)
+    started = time.perf_counter()
+    results = index.search(" ".join(args.query), set(args.kind) if args.kind else None)
+    elapsed = time.perf_counter() - started
+
+    for line in results[:args.limit or None]:
+        print(f"{location(line)}\t[{TEXT_CODES[line[4]]}]\t{line[5]}")
+    print(f"{len(results)} lines ({elapsed * 1000:.1f} ms)", file=sys.stderr)
+    return 0 if results else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
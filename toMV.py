@@ -1,10 +1,16 @@
-from rubymarshal.reader import load
+from rubymarshal.reader import load, Reader
 from rubymarshal.classes import RubyObject, RubyString, UserDef, registry, Symbol
 from struct import *
+from array import array
 import json
-import ctypes
 import os
 import re
+import sys
+import zlib
+from functools import partial, wraps
+
+import rpgmarshal
+from textindex import TextIndex
 
 def convert_str(value):
     if isinstance(value, bytes):
@@ -163,6 +169,74 @@ def convert_to_js(params): # Convert some commands to the MV / JS equivalent.
     return out
     
 
+# Per-command output (comments, script calls), turned off by --quiet
+verbose = True
+
+def note(*args):
+    if verbose:
+        print(*args)
+
+# Classes whose converted form is memoized, see rpgmarshal.Reader(spans=)
+MEMO_CLASSES = ("RPG::Event::Page", "RPG::MoveRoute")
+
+class ConversionMemo:
+    """Converted map event pages and move routes keyed by their Marshal bytes.
+
+    Off by default (toMV.py --memo --marshal rpgmarshal). Sources read by
+    rpgmarshal with spans=MEMO_CLASSES carry the bytes they were decoded
+    from, so the key costs a hash of bytes already in memory and a page
+    repeated on a map (doors, chests, copied NPCs) is converted once. Equal
+    bytes only mean equal content within one file: clear() the memo before
+    the next one. Sources without a span are converted as usual.
+
+    Results are shared between every caller that hits the same key and
+    must be treated as read-only; they are stored already passed through
+    convert_ruby_strings, which returns them as is.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.results = {}
+        self.shared = set()  # ids of the stored results
+        self.hits = {}
+        self.misses = {}
+
+    def convert(self, kind, convert, source):
+        span = getattr(source, "marshal_span", None) if self.enabled else None
+        if span is None:
+            return convert(source)
+        key = (kind, span)
+        result = self.results.get(key)
+        if result is None:
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+            result = self.results[key] = convert_ruby_strings(convert(source))
+            self.shared.add(id(result))
+        else:
+            self.hits[kind] = self.hits.get(kind, 0) + 1
+        return result
+
+    def clear(self):
+        """Forget the results (keeping the counts), before the next file"""
+        self.results.clear()
+        self.shared.clear()
+
+    def report(self):
+        lines = []
+        for kind in sorted(set(self.hits) | set(self.misses)):
+            hits = self.hits.get(kind, 0)
+            total = hits + self.misses.get(kind, 0)
+            lines.append(f"{kind}: {hits}/{total} hits ({100 * hits / total:.1f}%)")
+        return "Conversion memo: " + (", ".join(lines) if lines else "unused")
+
+conversion_memo = ConversionMemo()
+
+def memoized(kind):
+    def decorate(convert):
+        @wraps(convert)
+        def wrapper(source):
+            return conversion_memo.convert(kind, convert, source)
+        return wrapper
+    return decorate
+
 def get_command_list(commands):
     if not commands:
         return [{"code":0,"indent":0,"parameters":[]}] # TODO !!!
@@ -188,7 +262,7 @@ def get_command_list(commands):
         elif code == 104:  # Key Item Processing
             params[1] = 2  # Key item type
         elif code in (108, 408):  # Comment
-            print(params[0])
+            note(params[0])
         elif code == 111:  # Conditional Branch
             if params[0] == 11:  # Key Pressed
                 key_mapping = {
@@ -205,10 +279,10 @@ def get_command_list(commands):
                                 'pageup', 'pagedown']
                     params[1] = key_names[params[1]]
             elif params[0] == 12:  # Script
-                print('Conditional Branch script call', params[1])
+                note('Conditional Branch script call', params[1])
         elif code == 122:  # Control Variables
             if params[3] == 4:  # Script
-                print('Control Variables script call', params[4])
+                note('Control Variables script call', params[4])
         elif code == 231:  # Show Picture (with subtract blend mode)
             if params[9] == 2:
                 code = 355
@@ -262,7 +336,7 @@ def get_command_list(commands):
         elif code == 505:  # Move Route
             mvrcmd = params[0]
             if mvrcmd.attributes.get("@code", 0) == 45:  # Script in move route
-                print('Move Route Script call', mvrcmd.attributes.get("@parameters", []))
+                note('Move Route Script call', mvrcmd.attributes.get("@parameters", []))
 
         # Convert command to dict
         converted.append({
@@ -277,6 +351,7 @@ def _var_or_value(is_variable, value):
     return (f'$gameVariables.value({value})' 
             if is_variable == 1 else str(value))
 
+@memoized("move routes")
 def get_move_route(move_route):
     if not move_route:
         return {"list":[{"code":0,"parameters":[]}],"repeat":True,"skippable":False,"wait":False}
@@ -334,12 +409,12 @@ def get_anim_frames(anim):
             frame = frame_list[f]
             cell_data = frame.attributes.get('@cell_data', [])
             cell_max = frame.attributes.get('@cell_max', 0)
-            out.append([
-                [
-                    int(ctypes.c_int16(cell_data.flags[i]).value) 
-                    for i in range(offset, len(cell_data.flags), cell_max)
-                ] for offset in range(cell_max)
-            ])
+            if not cell_max:
+                out.append([])
+                continue
+            # Reinterpret the whole table as int16 once, then slice out each cell
+            cells = array("h", array("H", cell_data.flags).tobytes())
+            out.append([cells[offset::cell_max].tolist() for offset in range(cell_max)])
         else:
             out.append([])
     return out
@@ -479,6 +554,8 @@ def find_ruby_string(data):
                 find_ruby_string(value)
 
 def convert_ruby_strings(data):
+    if id(data) in conversion_memo.shared:
+        return data  # Already converted, and shared with other maps
     if isinstance(data, dict):
         return {k: convert_ruby_strings(v) for k, v in data.items()}
     elif isinstance(data, list):
@@ -537,14 +614,14 @@ def get_map_data(data, events, width: int, height: int):
     
     # Shadow layer
     z = 3
-    layers.append(data.flags[width*height * z: width*height * (z+1)])
+    layers.extend(data.flags[width*height * z: width*height * (z+1)])
 
     # for y in range(width): # data.ysize):
     #     for x in range(height): # data.xsize):
     #         layers.append(0) # data[x, y, z]) # z4
     
     # Region layer
-    layers.append([
+    layers.extend([
         i >> 8
         for i in data.flags[width*height * z: width*height * (z+1)]
     ])
@@ -554,6 +631,48 @@ def get_map_data(data, events, width: int, height: int):
     
     return layers
 
+MAP_DATA_ENCODING = "uint16le"
+
+def dump_map_data(layers, path, compress=True):
+    """Write map tile layers to a binary sidecar, return the JSON reference"""
+    data = array("H", layers)
+    if sys.byteorder != "little":
+        data.byteswap()
+    raw = data.tobytes()
+    with open(path, "wb") as out:
+        out.write(zlib.compress(raw) if compress else raw)
+    return {
+        "file": os.path.basename(path),
+        "encoding": MAP_DATA_ENCODING,
+        "compression": "zlib" if compress else None,
+        "length": len(data)
+    }
+
+def load_map_data(ref, folder):
+    """Read back a sidecar written by dump_map_data as a list of ints"""
+    if ref.get("encoding") != MAP_DATA_ENCODING:
+        raise ValueError(f"Unsupported map data encoding: {ref.get('encoding')}")
+    with open(os.path.join(folder, ref["file"]), "rb") as f:
+        raw = f.read()
+    if ref.get("compression") == "zlib":
+        raw = zlib.decompress(raw)
+    data = array("H")
+    data.frombytes(raw)
+    if sys.byteorder != "little":
+        data.byteswap()
+    if len(data) != ref.get("length", len(data)):
+        raise ValueError(f"Truncated map data: {ref['file']}")
+    return data.tolist()
+
+def load_map_json(path):
+    """Load a MapXXX.json, inlining the tile data if it lives in a sidecar"""
+    with open(path, "r", encoding="utf-8") as f:
+        json_data = json.load(f)
+    ref = json_data.pop("dataFile", None)
+    if ref:
+        json_data["data"] = load_map_data(ref, os.path.dirname(path))
+    return json_data
+
 def is_tile_event(event):
     pages = event.attributes.get("@pages", [])
     if len(pages) != 1:
@@ -598,6 +717,7 @@ def get_event(event):
         "y": event.attributes.get("@y", 0)
     }
 
+@memoized("pages")
 def get_page(page):
     cond = page.attributes.get("@condition", None)
     if not cond:
@@ -1057,28 +1177,210 @@ registry.register(CommonEvent)
 registry.register(MapInfo)
 registry.register(System)
 registry.register(Map)
-    
+
+MARSHAL_READERS = ("rubymarshal", "rpgmarshal")
+
+def load_rvdata(f, reader="rubymarshal", spans=()):
+    """Load a whole rvdata2 file with rubymarshal or the faster rpgmarshal.
+
+    spans is passed to rpgmarshal (see ConversionMemo), rubymarshal has no
+    use for it.
+    """
+    if reader == "rpgmarshal":
+        return rpgmarshal.load(f, spans=spans)
+    return load(f)
+
+_DROPPED = object()
+
+class _StreamReader(Reader):
+    # rubymarshal Reader that refuses links to dropped objects
+    def read(self, in_ivar=False):
+        result = super().read(in_ivar)
+        if result is _DROPPED:
+            raise rpgmarshal.LinkError("Invalid link destination (dropped with an earlier element)")
+        return result
+
+def iter_rvdata_array(f, reader="rubymarshal"):
+    """Yield the elements of a top-level Marshal array one at a time.
+
+    Objects read for an element are dropped from the link table once the
+    next element is requested, so a link back into an earlier element
+    raises rpgmarshal.LinkError (use load() for such files).
+    """
+    if reader == "rpgmarshal":
+        yield from rpgmarshal.iter_array(f.read())
+        return
+
+    if f.read(2) != b"\x04\x08":
+        raise ValueError("Expected Marshal 4.8 header")
+    if f.read(1) != b"[":
+        raise ValueError("Expected a top-level array")
+
+    reader = _StreamReader(f)
+    reader.objects.append(None)  # the top-level array itself
+    for _ in range(reader.read_long()):
+        start = len(reader.objects)
+        yield reader.read()
+        for i in range(start, len(reader.objects)):
+            reader.objects[i] = _DROPPED
+
+def dump_json_array(items, out):
+    """Write items as a JSON list, same layout as json.dump(..., indent=2)"""
+    first = True
+    for item in items:
+        out.write("[\n  " if first else ",\n  ")
+        out.write(json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+        first = False
+    out.write("[]" if first else "\n]")
+
+def _open_binary(path):
+    return open(path, "rb")
+
+def _visited(items, visit):
+    for item in items:
+        if item is not None:
+            visit(item)
+        yield item
+
+def convert_database(src, dst, stream=False, opener=_open_binary, reader="rubymarshal", visit=None, restart=None):
+    """Convert a [nil, RPG::X, ...] rvdata2 file to its MV JSON list.
+
+    visit(item) is called with each converted record, e.g. to index it.
+    With stream, records are converted, visited and written one at a time.
+    A file whose records share objects (Ruby writes a link to an object met
+    in an earlier record) cannot be streamed: it is loaded whole instead,
+    after restart() has undone what visit did with the streamed records.
+    """
+    if stream:
+        try:
+            with opener(src) as f, open(dst, "w", encoding="utf-8") as out:
+                items = (
+                    obj.tojson() if idx and obj else None
+                    for idx, obj in enumerate(iter_rvdata_array(f, reader))
+                )
+                dump_json_array(_visited(items, visit) if visit else items, out)
+            return
+        except rpgmarshal.LinkError as e:
+            print(f"Streaming failed for {src} ({e}), loading it whole")
+            if restart:
+                restart()
+
+    with opener(src) as f:
+        classes = load_rvdata(f, reader)
+    json_data = [None] + [cls.tojson() if cls else None for cls in classes[1:]]
+    if visit:
+        for item in json_data:
+            if item is not None:
+                visit(item)
+
+    with open(dst, "w", encoding="utf-8") as out:
+        json.dump(json_data, out, ensure_ascii=False, indent=2)
+
+def _tojson_any(data):
+    # Converted form of any Data/ file: database list, MapInfos hash, or one object
+    if isinstance(data, list):
+        return [obj.tojson() if idx and obj else None for idx, obj in enumerate(data)]
+    if isinstance(data, dict):
+        return {key: obj.tojson() for key, obj in data.items()}
+    return convert_ruby_strings(data.tojson())
+
+def _json_tree(data):
+    # data with each value tagged by its exact type, so 1, 1.0 and True or a
+    # str and bytes never compare equal; anything json.dump would not write
+    # raises TypeError
+    if isinstance(data, dict):
+        return ("dict", tuple((_json_tree(key), _json_tree(value)) for key, value in data.items()))
+    if isinstance(data, list):
+        return ("list", tuple(_json_tree(value) for value in data))
+    if isinstance(data, float):
+        return ("float", repr(data))
+    if data is None:
+        return ("null", None)
+    for kind in (bool, int, str):
+        if isinstance(data, kind):
+            return (kind.__name__, data)
+    raise TypeError(f"{type(data).__name__} is not a JSON value")
+
+def check_marshal(opener, names):
+    """Load each file with both Marshal readers and compare the converted data.
+
+    Converted values must be plain JSON types, compared type for type. A
+    file that fails to load or convert with either reader counts as a
+    mismatch. Returns the names whose output differs.
+    """
+    mismatches = []
+    for name in names:
+        outputs = []
+        for reader in MARSHAL_READERS:
+            with opener(name) as f:
+                try:
+                    outputs.append(_json_tree(_tojson_any(load_rvdata(f, reader))))
+                except Exception as e:
+                    print(f"FAILED: {name} with {reader}: {type(e).__name__}: {e}")
+                    break
+        if len(outputs) < len(MARSHAL_READERS) or outputs[0] != outputs[1]:
+            mismatches.append(name)
+            print(f"Mismatch: {name}")
+    print(f"Marshal check: {len(names) - len(mismatches)} of {len(names)} files identical")
+    return mismatches
+
 import json
 import argparse
-import sys
 from dataclasses import dataclass
 
 
 def main():
+    parser = argparse.ArgumentParser(description="Convert RPG Maker VX Ace data in OUT/Data to RPG Maker MV JSON")
+    parser.add_argument("--binary-maps", action="store_true", help="Write map tile layers to a MapXXX.bin sidecar (uint16 LE)")
+    parser.add_argument("--no-compress", action="store_true", help="Do not zlib-compress the map tile sidecar")
+    parser.add_argument("--stream", action="store_true", help="Convert database files one record at a time (files whose records share objects are loaded whole)")
+    parser.add_argument("--archive", help="Read Data/*.rvdata2 straight from this Game.rgss3a (needs dec.py)")
+    parser.add_argument("--marshal", choices=MARSHAL_READERS, default="rubymarshal", help="Marshal reader (rpgmarshal is faster)")
+    parser.add_argument("--check-marshal", action="store_true", help="Compare both Marshal readers on every Data file and exit")
+    parser.add_argument("--memo", action="store_true",
+                        help="Convert event pages and move routes repeated on a map once (needs --marshal rpgmarshal)")
+    parser.add_argument("--quiet", action="store_true", help="Do not print comments and script calls met while converting")
+    parser.add_argument("--text-index", nargs="?", const="OUT/dialogue-index.json",
+                        help="Index Show Text, choices and comments for textindex.py (default OUT/dialogue-index.json)")
+    args = parser.parse_args()
+    global verbose
+    verbose = not args.quiet
+    if args.memo and args.marshal != "rpgmarshal":
+        parser.error("--memo keys pages by their Marshal bytes, which only --marshal rpgmarshal keeps")
+    conversion_memo.enabled = args.memo
+    text_index = TextIndex() if args.text_index else None
+    visitors = {}
+    if text_index:
+        visitors = {
+            "CommonEvents": lambda item: text_index.add_common_event("CommonEvents.json", item),
+            "Troops": lambda item: text_index.add_troop("Troops.json", item),
+        }
+
+    if args.archive:
+        from dec import ArchiveFS
+        fs = ArchiveFS(args.archive)
+        os.makedirs("OUT/Data", exist_ok=True)
+        open_source = lambda name: fs.open(f"Data/{name}")
+        source_names = fs.listdir("Data")
+    else:
+        open_source = lambda name: open(f"OUT/Data/{name}", "rb")
+        source_names = os.listdir("OUT/Data/")
+
+    if args.check_marshal:
+        names = sorted(n for n in source_names if n.endswith(".rvdata2") and n != "Scripts.rvdata2")
+        return 1 if check_marshal(open_source, names) else 0
 
     for item in [
         "Actors", "Classes", "Skills", "Items", "Weapons", "Armors", "Enemies", "Troops", "States", "Animations", "Tilesets", "CommonEvents"
     ]:
-        with open(f"OUT/Data/{item}.rvdata2", "rb") as f:
-            classes = load(f)
-            json_data = [None] + [cls.tojson() if cls else None for cls in classes[1:]]
-            
-            with open(f"OUT/Data/{item}.json", "w", encoding="utf-8") as out:
-                json.dump(json_data, out, ensure_ascii=False, indent=2)
+        # A fallback to a full load drops the lines indexed while streaming
+        restart = partial(text_index.truncate, len(text_index.lines)) if text_index else None
+        convert_database(f"{item}.rvdata2", f"OUT/Data/{item}.json", stream=args.stream, opener=open_source,
+                         reader=args.marshal, visit=visitors.get(item), restart=restart)
     
     # MapInfos is special
-    with open(f"OUT/Data/MapInfos.rvdata2", "rb") as f:
-        classes = load(f)
+    with open_source("MapInfos.rvdata2") as f:
+        classes = load_rvdata(f, args.marshal)
 
         json_data = [None]
         
@@ -1092,28 +1394,42 @@ def main():
 
     # System is also special
     maps = [
-        i.split(".")[0] for i in os.listdir("OUT/Data/")
+        i.split(".")[0] for i in source_names
         if i.startswith("Map") and i.endswith(".rvdata2") and not i.startswith("MapInfos")
     ]
 
     for item in [
         "System"
     ]:
-        with open(f"OUT/Data/{item}.rvdata2", "rb") as f:
-            classes = load(f)
+        with open_source(f"{item}.rvdata2") as f:
+            classes = load_rvdata(f, args.marshal)
             json_data = convert_ruby_strings(classes.tojson())
             
             with open(f"OUT/Data/{item}.json", "w", encoding="utf-8") as out:
                 json.dump(json_data, out, ensure_ascii=False, indent=2)
 
+    memo_spans = MEMO_CLASSES if conversion_memo.enabled else ()
     for map in maps:
-        with open(f"OUT/Data/{map}.rvdata2", "rb") as f:
-            classes = load(f)
+        with open_source(f"{map}.rvdata2") as f:
+            classes = load_rvdata(f, args.marshal, memo_spans)
             json_data = convert_ruby_strings(classes.tojson())
+            if text_index:
+                text_index.add_map(f"{map}.json", json_data)
+
+            if args.binary_maps:
+                json_data["dataFile"] = dump_map_data(
+                    json_data.pop("data"), f"OUT/Data/{map}.bin", compress=not args.no_compress
+                )
             
             with open(f"OUT/Data/{map}.json", "w", encoding="utf-8") as out:
                 json.dump(json_data, out, ensure_ascii=False, indent=2)
+        conversion_memo.clear()
 
+    if conversion_memo.enabled:
+        print(conversion_memo.report())
+    if text_index:
+        text_index.save(args.text_index)
+        print(f"Text index: {len(text_index.lines)} lines, {len(text_index.postings)} tokens in {args.text_index}")
 
     return
 
@@ -1187,4 +1503,4 @@ def main():
     return
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file